@@ -0,0 +1,234 @@
+import asyncio, time, socket
+import utility as Utility
+import window as Window
+import session as Session
+
+class RDTProtocol(asyncio.DatagramProtocol):
+
+    # Runs one Session.Session on an asyncio event loop instead of a blocking socket
+    # Packets are read and written with Utility.PacketCodec, so it is wire-compatible with RDTSocket
+    # Unlike RDTSocket, datagrams do not go through an Impairment.Impairment
+    # session is the Session.SenderSession to run; None waits for a START packet and starts a Session.ReceiverSession
+    # sink is where a received file is written, maxPayloadSize the largest DATA payload accepted and messages splits what is
+    # received into messages, and ackEvery and ackDelay set how ACKs are coalesced; see Session.ReceiverSession
+    def __init__(self, session = None, windowSize = None, selectiveAck = True, sink = None, maxPayloadSize = None, messages = False, ackEvery = None, ackDelay = None):
+        self.session = session
+        self.windowSize = windowSize     # Receiver window size, used if session is None
+        self.selectiveAck = selectiveAck
+        self.sink = sink
+        self.maxPayloadSize = maxPayloadSize
+        self.messages = messages
+        self.ackEvery = ackEvery
+        self.ackDelay = ackDelay
+        self.waiters = []                # (condition, future) pairs; see wait
+        self.transport = None
+        self.targetAddress = None        # Address of the sender once a START packet has been received; None for senders
+        self.timer = None                # asyncio.TimerHandle that calls transmit at session.nextDeadline()
+
+        loop = asyncio.get_running_loop()
+        self.completed = loop.create_future() # Set once the session has delivered the file
+        self.closed = loop.create_future()    # Set once the session has finished and the transport is closed
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.session != None:
+            self.transmit()
+
+    def datagram_received(self, data, address):
+        packet = Utility.PacketCodec.decode(data, address)
+        if packet == None: # Corrupted and malformed datagrams are dropped
+            return
+        if self.session == None:
+            if packet.packetHeader.type != 0: # Wait for a START packet
+                return
+            self.session = Session.ReceiverSession(packet, self.windowSize, self.selectiveAck, self.sink, self.maxPayloadSize, self.messages, self.ackEvery, self.ackDelay)
+            self.targetAddress = address
+        elif self.targetAddress != None and address != self.targetAddress: # Ignore other senders
+            return
+        else:
+            self.session.receive(packet, time.monotonic_ns())
+        self.transmit()
+
+    # Errors such as ICMP port unreachable are treated like lost packets; the session's timers retransmit
+    def error_received(self, exc):
+        pass
+
+    def connection_lost(self, exc):
+        if self.timer != None:
+            self.timer.cancel()
+        if not self.completed.done():
+            self.completed.set_exception(exc if exc != None else Exception("RDTProtocol: connection closed before the transfer completed"))
+        for (condition, future) in self.waiters:
+            if not future.done():
+                future.set_exception(exc if exc != None else Exception("RDTProtocol: connection closed"))
+        self.waiters = []
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    # Send what the session has to send and wake up again at its next deadline
+    def transmit(self):
+        session = self.session
+        for packet in session.transmit(time.monotonic_ns()):
+            self.transport.sendto(Utility.PacketCodec.encode(packet), self.targetAddress)
+        if session.complete and not self.completed.done():
+            self.completed.set_result(session)
+        if len(self.waiters) > 0:
+            waiting = []
+            for (condition, future) in self.waiters:
+                if future.done():
+                    continue
+                if condition():
+                    future.set_result(None)
+                else:
+                    waiting.append((condition, future))
+            self.waiters = waiting
+
+        if self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+        if session.finished:
+            self.transport.close()
+            return
+        deadline = session.nextDeadline()
+        if deadline != None: # The default event loop clock is time.monotonic, so deadlines carry over directly
+            self.timer = asyncio.get_running_loop().call_at(deadline / 1e9, self.transmit)
+
+    # Wait until condition() returns True; it is checked every time the session has run
+    async def wait(self, condition):
+        if condition():
+            return
+        if self.transport != None and self.transport.is_closing():
+            raise Exception("RDTProtocol: connection closed")
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((condition, future))
+        await future
+
+class AsyncRDTSocket:
+
+    # The asyncio counterpart of RDTSocket: many can run concurrently on one event loop
+    # Each socket runs one transfer (one endpoint) at a time. A receiver can be used again: once its last transfer has finished
+    # lingering, recv_file or recv_message listens on the same address with a new endpoint
+    # congestionControl is a name from Congestion.controllers or a Congestion.CongestionController subclass
+    # selectiveAck turns SACK blocks on in ACKs sent by the receiver and their use by the sender
+    # maxDatagramSize, probeMTU, fecGroup, ackEvery, ackDelay and compression work as they do for RDTSocket
+    def __init__(self, windowSize, ip = None, port = None, congestionControl = "aimd", selectiveAck = True, maxDatagramSize = Utility.UnreliableSocket.maxDatagramSize, probeMTU = False, fecGroup = 0, ackEvery = None, ackDelay = None, compression = None):
+        self.address = (ip, port)            # Where the receiver listens
+        self.windowSize = windowSize
+        self.maxDatagramSize = maxDatagramSize
+        self.probeMTU = probeMTU
+        self.fecGroup = fecGroup
+        self.ackEvery = ackEvery
+        self.ackDelay = ackDelay
+        self.compression = compression
+        self.congestionControl = congestionControl
+        self.selectiveAck = selectiveAck
+        self.rtt = Window.RTTEstimator(Session.Session.waitTime) # Retransmission timeout measured from ACKs; kept between transfers
+        self.transport = None
+        self.protocol = None
+        self.session = None                  # Protocol state of the current (or last) transfer
+
+    # Bind the receiver's endpoint if it is not bound yet and return the address it listens on
+    # If the last transfer has been delivered, waits for its endpoint to close and binds a new one for the next sender
+    # The file will be written to sink, or split into messages; see Session.ReceiverSession
+    async def listen(self, sink = None, messages = False):
+        if self.protocol != None and self.protocol.completed.done():
+            await self.protocol.closed
+            self.protocol = None
+        if self.protocol == None:
+            loop = asyncio.get_running_loop()
+            (self.transport, self.protocol) = await loop.create_datagram_endpoint(lambda: RDTProtocol(None, self.windowSize, self.selectiveAck, sink, self.maxPayloadSize(), messages, self.ackEvery, self.ackDelay), local_addr = self.address)
+            self.address = self.transport.get_extra_info("sockname")
+        return self.address
+
+    # Send source to the receiver at address; returns once the END packet has been ACKed
+    # source is a binary file object, which is read as the window advances, or bytes, bytearray, mmap or str (sent as UTF-8)
+    async def send(self, source, address):
+        await self.open(source, address)
+        try:
+            await self.protocol.completed
+        finally:
+            self.close()
+
+    # Open a connection to the receiver at address for sending messages; returns once the START handshake is done
+    # Send messages with send_message; shutdown sends END once they have all been sent
+    async def connect(self, address):
+        session = await self.open(None, address)
+        try:
+            await self.protocol.wait(lambda: session.connected)
+        except:
+            self.close()
+            raise
+
+    # Send source (see send) as the next message of the connection opened by connect
+    # Returns once all of it has been read into the sender window; the receiver gets it with recv_message
+    async def send_message(self, source):
+        session = self.session
+        if not isinstance(session, Session.SenderSession) or session.closing:
+            raise Exception("AsyncRDTSocket.send_message: there is no open connection; see connect")
+        session.queueMessage(source)
+        queued = session.messagesQueued
+        self.protocol.transmit()
+        await self.protocol.wait(lambda: session.messagesRead >= queued)
+
+    # Wait until the receiver has every message sent on the connection
+    async def flush(self):
+        session = self.session
+        await self.protocol.wait(lambda: session.messagesAcked >= session.messagesQueued)
+
+    # Send END after the messages of the connection and wait for it to be ACKed
+    async def shutdown(self):
+        session = self.session
+        session.close()
+        self.protocol.transmit()
+        try:
+            await self.protocol.completed
+        finally:
+            self.close()
+
+    # Start a sender session for source (see Session.SenderSession) on a new endpoint connected to address and return it
+    async def open(self, source, address):
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.connect(address)
+        if self.probeMTU:
+            pathMTU = Utility.UnreliableSocket.pathMTU(sock)
+            if pathMTU != None:
+                self.maxDatagramSize = pathMTU
+        self.session = Session.SenderSession(source, self.windowSize, self.congestionControl, self.selectiveAck, self.rtt, self.maxPayloadSize(), self.fecGroup, self.compression)
+        (self.transport, self.protocol) = await loop.create_datagram_endpoint(lambda: RDTProtocol(self.session), sock = sock)
+        return self.session
+
+    # Receive one file and return it as bytes, or write it to sink and return None
+    # sink is only used if the endpoint is not listening yet; otherwise pass it to listen
+    # Returns as soon as the END packet arrives; the endpoint keeps ACKing retransmissions in the background
+    # for Session.ReceiverSession.lingerTime and then closes itself (see wait_closed)
+    async def recv_file(self, sink = None):
+        await self.listen(sink)
+        self.session = (await self.protocol.completed)
+        return self.session.receivedFile
+
+    # Receive the next message of a connection (see connect and send_message) as bytes
+    # Returns None once the sender has closed the connection; the endpoint then lingers and closes itself like recv_file
+    async def recv_message(self):
+        await self.listen(messages = True)
+        protocol = self.protocol
+        await protocol.wait(lambda: protocol.session != None and (len(protocol.session.messages) > 0 or protocol.session.complete))
+        self.session = protocol.session
+        if len(self.session.messages) > 0:
+            return self.session.messages.popleft()
+        return None
+
+    # Returns the largest DATA payload (in bytes) that fits in a datagram of maxDatagramSize
+    def maxPayloadSize(self) -> int:
+        return min(self.maxDatagramSize - Utility.PacketCodec.header.size, 2**16 - 1)
+
+    # Wait until the endpoint has closed
+    async def wait_closed(self):
+        if self.protocol != None:
+            await self.protocol.closed
+
+    # Close the endpoint now, without waiting for the receiver to finish lingering
+    def close(self):
+        if self.transport != None:
+            self.transport.close()
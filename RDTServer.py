@@ -0,0 +1,38 @@
+import time, queue, logging
+import utility as Utility
+import session as Session
+from RDTSocket import RDTSocket
+
+log = logging.getLogger(__name__)
+
+class RDTServer(RDTSocket):
+
+    # A receiver that serves many senders at once on one port; see Session.SessionTable
+    # Every file received is passed to onFile(address, receivedFile); without onFile it is put on self.files as (address, receivedFile)
+    # receivedFile is the file as bytes, or the sink openSink(address) returned for it
+    def __init__(self, windowSize, ip, port, onFile = None, selectiveAck = True, maxSessions = 64, idleTimeout = 3e10, openSink = None, maxDatagramSize = Utility.UnreliableSocket.maxDatagramSize, inbound = None, outbound = None, ackEvery = None, ackDelay = None):
+        RDTSocket.__init__(self, windowSize, ip, port, selectiveAck = selectiveAck, maxDatagramSize = maxDatagramSize, inbound = inbound, outbound = outbound, ackEvery = ackEvery, ackDelay = ackDelay)
+        self.connectOnSend = False # Connecting would stop datagrams from other senders from arriving
+        self.files = queue.Queue() # Files received, if there is no onFile callback
+        if onFile == None:
+            onFile = lambda address, receivedFile: self.files.put((address, receivedFile))
+        self.table = Session.SessionTable(windowSize, onFile, selectiveAck, maxSessions, idleTimeout, openSink, self.maxPayloadSize(), ackEvery, ackDelay)
+        self.running = False
+
+    # Serve senders until stop is called, or until files files have been received and every session has finished
+    def serve(self, files = None):
+        log.info("Serving at %s...", self.socket.getsockname())
+        self.running = True
+        while self.running:
+            for (packet, address) in self.table.transmit(time.monotonic_ns()):
+                self.sendto(packet, address)
+            if files != None and self.table.filesReceived >= files and len(self.table.sessions) == 0:
+                break
+            (recvPacket, _) = self.recv(self.table.nextDeadline())
+            if recvPacket != None:
+                self.table.receive(recvPacket, time.monotonic_ns())
+        self.running = False
+
+    # Make serve return; can be called from onFile
+    def stop(self):
+        self.running = False
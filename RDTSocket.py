@@ -1,239 +1,202 @@
-import time, random
+import time, logging, threading
 import utility as Utility
+import window as Window
+import session as Session
+
+log = logging.getLogger(__name__)
 
 class RDTSocket(Utility.UnreliableSocket):
     
-    packetStringSize = 100 # How long each string in the packet is. Can be adjusted but an exception will be thrown if it is set too large
     bufferSize = 2048      # How large the buffer is when receiving packets
-    waitTime = 5e8         # How long (in ns) to wait before retransmitting. Currently set to 500 ms
     
-    def __init__(self, windowSize, ip = None, port = None):
-        Utility.UnreliableSocket.__init__(self, ip, port) 
+    # congestionControl is a name from Congestion.controllers or a Congestion.CongestionController subclass
+    # selectiveAck turns SACK blocks on in ACKs sent by the receiver and their use by the sender
+    # maxDatagramSize is the largest datagram (in bytes) the socket sends or receives; the sender and receiver agree on the smaller one
+    # probeMTU makes the sender use the path MTU to the receiver instead of maxDatagramSize, where it can be read (Linux)
+    # inbound and outbound impair the datagrams the socket receives and sends; see Utility.UnreliableSocket
+    # fecGroup is the number of packets per PARITY packet the sender proposes; 0 turns FEC off (see fec.py)
+    # ackEvery and ackDelay set how the receiver coalesces ACKs; see Session.ReceiverSession
+    # compression is the codec the sender proposes (a name from Compression.codecs); None sends data as is
+    def __init__(self, windowSize, ip = None, port = None, congestionControl = "aimd", selectiveAck = True, maxDatagramSize = Utility.UnreliableSocket.maxDatagramSize, probeMTU = False, inbound = None, outbound = None, fecGroup = 0, ackEvery = None, ackDelay = None, compression = None):
+        Utility.UnreliableSocket.__init__(self, ip, port, inbound, outbound) 
+        self.maxDatagramSize = maxDatagramSize
+        self.probeMTU = probeMTU
+        self.fecGroup = fecGroup
+        self.ackEvery = ackEvery
+        self.ackDelay = ackDelay
+        self.compression = compression
         self.targetAddress = None            # Where to sends packets to
         self.startSeqNum = -1                # -1 because it has not been set yet
         
-        self.senderWindowSize = windowSize   # Window size
-        self.senderWindowPos = -1            # Window position tracks where the start of the window is. -1: not started; >1: working
+        self.windowSize = windowSize         # Largest window size; the congestion controller decides how much of the sender window to use
+        self.congestionControl = congestionControl
+        self.selectiveAck = selectiveAck
         
-        self.receiverWindowSize = windowSize # Window size
-        self.receiverWindowPos = -1          # Window position tracks the lower bound (inclusive) of the receiver window
-                                             # -1: not started; >1: working        
+        self.rtt = Window.RTTEstimator(Session.Session.waitTime) # Retransmission timeout measured from ACKs; kept between transfers
+        self.session = None                  # Protocol state of the current (or last) transfer; see Session.Session
+        self.lingerThread = None             # Runs the last receiver session after its file was returned; see lingerInBackground
         
     # How the receiver will accept new connections
-    def accept(self):
-        print(f"Waiting for START packet at {self.socket.getsockname()}...")
+    # The file will be written to sink, or split into messages; see Session.ReceiverSession
+    def accept(self, sink = None, messages = False):
+        self.waitClosed()
+        self.connectOnSend = False # Connecting to the first sender would stop START packets from any other sender from arriving
+        log.info("Waiting for START packet at %s...", self.socket.getsockname())
                 
         while True:
-            (recvPacket, _) = self.recv()
-            if recvPacket != None and recvPacket.packetHeader.type == 0:     # Check packet == START packet
-                self.receiverWindowPos = recvPacket.packetHeader.seq_num + 1 # Set the window position to the next expected packet
-                self.startSeqNum = recvPacket.packetHeader.seq_num           # Save the start sequence number for later use
-                self.targetAddress = recvPacket.packetHeader.address         # Save the target address
-                self.sendACK(recvPacket.packetHeader.seq_num)                # Send ACK to start receiving the message
+            (recvPacket, _) = self.recv(None)
+            if recvPacket != None and recvPacket.packetHeader.type == 0: # Check packet == START packet
+                self.session = Session.ReceiverSession(recvPacket, self.windowSize, self.selectiveAck, sink, self.maxPayloadSize(), messages, self.ackEvery, self.ackDelay)
+                self.startSeqNum = self.session.startSeqNum              # Save the start sequence number for later use
+                self.targetAddress = self.session.targetAddress          # Save the target address
                 break
         
-        print(f"Connected to ({self.targetAddress[0]}, {self.targetAddress[1]})")
+        log.info("Connected to (%s, %d)", self.targetAddress[0], self.targetAddress[1])
         
         return self.targetAddress
-
-    # How the sender will connect with the receiver
-    def connect(self, address):
-        print(f"Connecting to ({address[0]}, {address[1]})")
-        
-        # Connect to the socket
-        self.socket.connect(address)
-        self.targetAddress = address
-        
-        # Set the START sequence number
-        self.startSeqNum = random.randint(0, 2**30)
-        
-        # Send START and Wait until ACK
-        receivedACK = False
-        while not receivedACK:
-            # Send START message
-            self.sendto(Utility.Packet.newStartPacket(self.startSeqNum), self.targetAddress)
-            print(f"Sent START packet to {self.targetAddress}")
-            
-            # Wait for message; retransmit start if ACK is not received in time
-            startTime = time.time_ns()
-            while time.time_ns() - startTime < RDTSocket.waitTime:
-                (recvPacket, _) = self.recv()
-                
-                # Check for ACK; if received, move on
-                if recvPacket != None and recvPacket.packetHeader.type == 3 and recvPacket.packetHeader.seq_num == self.startSeqNum:
-                    receivedACK = True
-                    break
-        
-        print("START ACK received")
-        return self.startSeqNum
-    
-    # Send ACK of seq_num
-    def sendACK(self, seq_num):
-        self.sendto(Utility.Packet.newAckPacket(seq_num), self.targetAddress)
-        print("Sent ACK" + str(seq_num - self.startSeqNum).zfill(4))
     
     # How the sender will send the file
-    def send(self, fileString, address = None):        
-        ## Initialize
-        self.senderWindowPos = 1
-        
-        # Connect to the receiver (sends START message)
-        if address == None:
-            self.connect(self.targetAddress)
-        else:
-            self.connect(address)
-            self.targetAddress = address
-        
-        # Split the file into strings shorter than RDTSocket.packetStringSize
-        stringsToSend = [fileString[i:i+RDTSocket.packetStringSize] for i in range(0, len(fileString), RDTSocket.packetStringSize)]
-        
-        # Create packets and add them to the queue of packets to send
-        packetsToSend = [Utility.Packet.newDataPacket(self.startSeqNum + i + 1, stringsToSend[i]) for i in range(len(stringsToSend))]
-        # Add the end packet
-        packetsToSend.append(Utility.Packet.newEndPacket(self.startSeqNum + len(stringsToSend) + 1))
-        print(f"# packets to send: {len(packetsToSend)}\n")
-        
-        # Initialize queues
-        toSendQueue = list()
-        sentQueue = list()
+    # source is a binary file object, which is read as the window advances, or bytes, bytearray, mmap or str (sent as UTF-8)
+    def send(self, source, address = None):        
+        # Connect to the socket
+        self.connectSocket(address)
         
-        ## Send the file
-        startTime = time.time_ns()
-        while len(packetsToSend) != 0:
-            # Add packets to the sending queue
-            for packet in packetsToSend:
-                if packet.packetHeader.seq_num < self.startSeqNum + self.senderWindowPos + self.senderWindowSize and not packet.isInList(toSendQueue) and not packet.isInList(sentQueue):
-                    toSendQueue.append(packet)
-            
-            # Send a packet (if there is a packet to send)
-            if len(toSendQueue) > 0:
-                # Select the packet with the smallest sequence number in toSendQueue
-                toSendQueue.sort(key = Utility.Packet.getSeqNum)
-                packetToSend = toSendQueue.pop(0)
-                
-                # Send the packet
-                self.sendto(packetToSend, self.targetAddress)
-                sentQueue.append(packetToSend)
-                print("Sent P" + str(packetToSend.packetHeader.seq_num - self.startSeqNum).zfill(4) + " Size: " + str(packetToSend.compressedSize()).zfill(5))
-                
-            # Check for ACKs
-            (recvPacket, _) = self.recv()
-            if recvPacket != None and recvPacket.packetHeader.type == 3: # Check if it is ACK
-                seq_num = recvPacket.packetHeader.seq_num
-                print("Received ACK" + str(seq_num - self.startSeqNum).zfill(4))
-                
-                # Remove packet from queues
-                for packet in packetsToSend:                              # For every packet that has not been ACKed
-                    if packet.packetHeader.seq_num < seq_num:             # If the sequence number of that packet is less than the ACK number
-                        for l in [packetsToSend, toSendQueue, sentQueue]: # Remove that packet from every list used to store packets in the sending process
-                            while True: # Removes all duplicates from the queues
-                                try:
-                                    l.remove(packet)
-                                except:
-                                    break # The loop continues until the remove functions raises an exception
-                
-                # Advance window if necessary
-                if seq_num > self.startSeqNum + self.senderWindowPos:
-                    self.senderWindowPos = seq_num - self.startSeqNum
-                    startTime = time.time_ns() # Reset the timer when the window advances
-            
-            # Timeout
-            if time.time_ns() - startTime > RDTSocket.waitTime:
-                print(f"Timeout: {len(sentQueue)} scheduled to be retransmitted\n\t" + str([i.packetHeader.seq_num - self.startSeqNum for i in sentQueue]))
-                startTime = time.time_ns()
-                toSendQueue.extend(sentQueue) # Send all "sent" packets back to the "send" queue
-                sentQueue.clear()             # Clear the "sent" queue
+        # Send START, the file and END
+        self.session = Session.SenderSession(source, self.windowSize, self.congestionControl, self.selectiveAck, self.rtt, self.maxPayloadSize(), self.fecGroup, self.compression)
+        self.startSeqNum = self.session.startSeqNum
+        self.run(self.session)
+        self.logSummary(self.session)
         
         ## Close the connection
         self.close()
-        print("Complete")
-        
-    # How the receiver and sender will receive messages from each other
-    # This is where packets are verified
-    def recv(self):
-        recvTuple = self.recvfrom(RDTSocket.bufferSize)
-        (recvPacket, _) = recvTuple
-        if recvPacket == None or not recvPacket.verify_packet():
+    
+    # Open a connection to the receiver at address for sending messages; returns once the START handshake is done
+    # Send messages with sendMessage; close sends END once they have all been sent
+    def connect(self, address = None):
+        self.connectSocket(address)
+        session = Session.SenderSession(None, self.windowSize, self.congestionControl, self.selectiveAck, self.rtt, self.maxPayloadSize(), self.fecGroup, self.compression)
+        self.session = session
+        self.startSeqNum = session.startSeqNum
+        self.run(session, lambda: session.connected)
+    
+    # Send source (see send) as the next message of the connection opened by connect
+    # Returns once all of it has been read into the sender window, so messages that fit in the window are not waited on one by one
+    # The receiver gets it with recvMessage
+    def sendMessage(self, source):
+        session = self.session
+        if not isinstance(session, Session.SenderSession) or session.closing:
+            raise Exception("RDTSocket.sendMessage: there is no open connection; see connect")
+        session.queueMessage(source)
+        queued = session.messagesQueued
+        self.run(session, lambda: session.messagesRead >= queued)
+    
+    # Wait until the receiver has every message sent on the connection
+    def flush(self):
+        session = self.session
+        if isinstance(session, Session.SenderSession):
+            self.run(session, lambda: session.messagesAcked >= session.messagesQueued)
+    
+    # Connect the socket to the receiver at address (or the last address if it is None) and read the path MTU if probeMTU is set
+    def connectSocket(self, address):
+        self.waitClosed()
+        if address != None:
+            self.targetAddress = address
+        log.info("Connecting to (%s, %d)", self.targetAddress[0], self.targetAddress[1])
+        self.socket.connect(self.targetAddress)
+        if self.probeMTU:
+            pathMTU = Utility.UnreliableSocket.pathMTU(self.socket)
+            if pathMTU != None:
+                self.maxDatagramSize = pathMTU
+            log.info("Path MTU: %s; largest datagram %d bytes", pathMTU, self.maxDatagramSize)
+    
+    # Log what it took to send everything on the connection of session
+    def logSummary(self, session):
+        stats = session.stats
+        log.info("Sent %d packets: %d retransmitted after %d timeouts and %d fast retransmits; RTT p50 %s µs", stats.packetsSent,
+            stats.packetsRetransmitted, stats.timeouts, stats.fastRetransmits, stats.rtt.percentile(.5))
+    
+    # Drive session until done() returns True, or until it finishes if done is None; a finished session drains the outbound impairment
+    # Each round sends what the session has to send, then sleeps until a packet arrives or its next timer fires
+    def run(self, session, done = None):
+        while True:
+            for packet in session.transmit(time.monotonic_ns()):
+                self.sendto(packet, self.targetAddress)
+            if session.finished:
+                self.drain() # Send the last packets (such as the ACK that lets the receiver close) if they are still delayed
+                break
+            if done != None and done():
+                break
+            (recvPacket, _) = self.recv(session.nextDeadline())
             if recvPacket != None:
-                print("Invalid packet received")
-            return (None, None)
-        else:
-            return recvTuple
-    
-    # How the recvFile function closes the connection
-    def recvFile_closeConnection(self):
-        # Send initial ACK
-        self.sendACK(self.receiverWindowPos)
-        
-        # Make sure the ACK has been received
-        # Wait 10 * default wait time to make sure the END message is not being re-sent
-        startTime = time.time_ns()
-        while time.time_ns() - startTime < RDTSocket.waitTime * 10:            
-            (recvPacket, _) = self.recv()
-            if recvPacket != None and recvPacket.packetHeader.type == 1 and recvPacket.packetHeader.seq_num == self.receiverWindowPos - 1:
-                startTime = time.time_ns()
-                self.sendACK(self.receiverWindowPos)
-        
-        # Close
-        self.close()
-        print("Closed connection")
+                session.receive(recvPacket, time.monotonic_ns())
+    
+    # Returns the largest DATA payload (in bytes) that fits in a datagram of maxDatagramSize
+    def maxPayloadSize(self) -> int:
+        return min(self.maxDatagramSize - Utility.PacketCodec.header.size, 2**16 - 1)
+    
+    # How the receiver and sender will receive messages from each other
+    # Packets are verified by Utility.PacketCodec.decode; corrupted ones are dropped
+    # Blocks until deadline (time.monotonic_ns) at the latest; see Utility.UnreliableSocket.recvfrom
+    def recv(self, deadline = 0):
+        invalidDatagrams = self.stats.invalidDatagrams
+        recvTuple = self.recvfrom(max(RDTSocket.bufferSize, self.maxDatagramSize), deadline)
+        if self.stats.invalidDatagrams > invalidDatagrams:
+            log.debug("Invalid packet received")
+        return recvTuple
     
     # The entire process to receive a file from accepting a sender connection and closing the socket
-    def recvFile(self):
+    # The file is written to sink (anything with a write method that takes bytes) as it arrives
+    # Without a sink the file is returned as bytes; with one, None is returned
+    # Returns once the END packet has arrived; the session lingers in the background (see lingerInBackground)
+    def recvFile(self, sink = None):
         ## Wait for accept
-        self.accept()
-        
-        ## Initialize file receiving
-        buffer = {}
-        receivedFile = ""
+        self.accept(sink)
+        session = self.session
         
-        ## Receive data packets
-        while True:
-            
-            # Check for new packets
-            (recvPacket, _) = self.recv()
-            if recvPacket != None and (recvPacket.packetHeader.type == 1 or recvPacket.packetHeader.type == 2 or recvPacket.packetHeader.type == 0):
-                seq_num = recvPacket.packetHeader.seq_num
-                print("Received P" + str(seq_num - self.startSeqNum).zfill(4) + f" Type: {recvPacket.packetHeader.type}")
-                
-                # Check start condition
-                if recvPacket.packetHeader.type == 0 and recvPacket.packetHeader.seq_num == self.startSeqNum and self.receiverWindowPos == self.startSeqNum + 1:
-                    self.sendACK(recvPacket.packetHeader.seq_num)
-                
-                # Check end condition
-                if recvPacket.packetHeader.type == 1 and self.receiverWindowPos == seq_num:
-                    self.receiverWindowPos += 1
-                    self.recvFile_closeConnection()
-                    return receivedFile
-                
-                # See if packet is in window
-                if seq_num >= self.receiverWindowPos - 1 and seq_num < self.receiverWindowPos + self.receiverWindowSize: # If yes
-                    buffer[recvPacket.packetHeader.seq_num] = recvPacket                                                 # Add to buffer
-                elif seq_num < self.receiverWindowPos:   # If no
-                    self.sendACK(self.receiverWindowPos) # Send ACK to indicate expected packet
-                
-                # Process buffer and advance window
-                seq_nums = list(buffer.keys())
-                seq_nums.sort()
-                print([i - self.startSeqNum for i in seq_nums])
-                for num in seq_nums:                               # Process the packets in order of increasing sequence number
-                    if num < self.receiverWindowPos:               # If there are old packets in the buffer
-                        buffer.pop(num)                            #     Remove them
-                    elif num == self.receiverWindowPos:            # If the packet is the next packet expected
-                        self.receiverWindowPos += 1                #     Advance window pos 1
-                        if buffer[num].packetHeader.type == 1:     #     If end condition
-                            self.recvFile_closeConnection()        #         End connection
-                            return receivedFile                    #         Return file contents
-                        else:                                      #     Else
-                            receivedFile += buffer.pop(num).text   #         Add the packet contents to the file contents
-                            print(f"Processed P" + str(num - self.startSeqNum).zfill(4) + "; Window advanced")
-                    else:
-                        print("Can't process further. Waiting on P" + str(self.receiverWindowPos - self.startSeqNum).zfill(4) + ". Lowest in buffer is P" + str(num - self.startSeqNum).zfill(4))
-                        break # If there is a missing packet, stop processing and wait for more packets to come in
-                
-                # Send ACK
-                self.sendACK(self.receiverWindowPos)
+        ## Receive data packets, then linger in the background
+        self.run(session, lambda: session.complete)
+        self.lingerInBackground()
+        return session.receivedFile
+    
+    # Receive the next message of a connection (see connect and sendMessage) as bytes
+    # Waits for a sender to connect if no connection is open; returns None once the sender has closed the connection
+    def recvMessage(self):
+        session = self.session
+        if not isinstance(session, Session.ReceiverSession) or not session.splitMessages or self.lingerThread != None:
+            self.accept(messages = True)
+            session = self.session
+        self.run(session, lambda: len(session.messages) > 0 or session.complete)
+        if len(session.messages) > 0:
+            return session.messages.popleft()
+        self.lingerInBackground()
+        return None
+    
+    # Keep running the receiver session on a thread after its file has been returned: the sender may still re-send the END packet
+    # if the ACK of it was lost. The session finishes as soon as the sender confirms the ACK, or after Session.ReceiverSession.lingerTime
+    def lingerInBackground(self):
+        self.lingerThread = threading.Thread(target = self.run, args = (self.session,), name = "RDTSocket linger")
+        self.lingerThread.start()
+    
+    # Wait until the last receiver session has finished lingering
+    # Called before the socket is used for another connection, since only one session can run on it at a time
+    def waitClosed(self):
+        if self.lingerThread != None:
+            self.lingerThread.join()
+            self.lingerThread = None
+    
+    # Returns the counters of the socket and of the current (or last) session as a dict that can be written as JSON
+    def statistics(self) -> dict:
+        return {
+            "socket": self.stats.asDict(),
+            "session": self.session.stats.asDict() if self.session != None else None,
+        }
     
     # How the server and client will close their connections
+    # A connection opened by connect sends END after its messages and returns once END has been ACKed
+    # A receiver that is lingering keeps doing so in the background; see waitClosed
     def close(self):
-        pass
\ No newline at end of file
+        session = self.session
+        if isinstance(session, Session.SenderSession) and not session.finished:
+            session.close()
+            self.run(session)
+            self.logSummary(session)
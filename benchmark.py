@@ -0,0 +1,543 @@
+import sys, os, time, random, pickle, contextlib, multiprocessing, threading, asyncio, tempfile, tracemalloc, itertools, logging, argparse, json, platform, statistics, subprocess
+import utility as Utility
+import metrics as Metrics
+import window as Window
+import session as Session
+import striping as Striping
+from RDTSocket import RDTSocket
+from RDTProtocol import AsyncRDTSocket
+
+# Sample text used to fill data packets
+with open("alice.txt", "rb") as f:
+    sampleText = f.read()[:Session.Session.packetPayloadSize]
+
+# Prints one row of a results table
+def printRow(*columns):
+    print("".join(Utility.Debug.rightFill(str(column), 24) for column in columns))
+
+# Times fn over a number of iterations and returns the average time per iteration in ns
+def timeIt(fn, iterations) -> float:
+    startTime = time.perf_counter_ns()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter_ns() - startTime) / iterations
+
+# Compares the round trip time and wire size of pickle with Utility.PacketCodec
+def benchmarkCodec(iterations = 100000):
+    packets = {
+        "ACK": Utility.Packet.newAckPacket(12345),
+        "DATA": Utility.Packet.newDataPacket(12345, sampleText),
+    }
+
+    printRow("packet", "format", "bytes", "round trip (ns)", "packets/s")
+    for (name, packet) in packets.items():
+        for (format, encode, decode) in [("pickle", pickle.dumps, pickle.loads), ("codec", Utility.PacketCodec.encode, Utility.PacketCodec.decode)]:
+            roundTrip = timeIt(lambda: decode(encode(packet)), iterations)
+            printRow(name, format, len(encode(packet)), f"{roundTrip:.0f}", f"{1e9 / roundTrip:.0f}")
+
+# Drives Window.SendWindow with a simulated receiver to show how its cost scales with the file size
+# Each round sends everything the window allows, drops lossRate of the packets and ACKs cumulatively
+# A round that ACKs nothing is treated as a timeout
+def benchmarkWindow(sizes = (10**4, 10**5, 10**6, 10**7, 10**8), windowSize = 64, lossRate = .01):
+    printRow("file size (bytes)", "packets", "time (ms)", "ns/packet")
+    for size in sizes:
+        fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+        rng = random.Random(size)
+        window = Window.SendWindow(Session.SenderSession.splitIntoPackets(fileData, 0), 1, windowSize)
+        received = set()
+        expected = 1 # Next sequence number the simulated receiver is waiting for
+
+        startTime = time.perf_counter_ns()
+        while not window.isDone():
+            packet = window.nextToSend()
+            while packet != None:
+                window.markSent(packet.packetHeader.seq_num, 0)
+                if rng.random() >= lossRate:
+                    received.add(packet.packetHeader.seq_num)
+                packet = window.nextToSend()
+            while expected in received:
+                received.remove(expected)
+                expected += 1
+            if window.ack(expected) == 0:
+                window.requeueInFlight()
+        elapsed = time.perf_counter_ns() - startTime
+
+        printRow(size, expected - 1, f"{elapsed / 1e6:.1f}", f"{elapsed / (expected - 1):.0f}")
+
+# Receives one file on a socket bound to an ephemeral port and sends back the file and the receiver's counts
+# Runs in a separate process, or in a thread of the sender's process (see runTransfer)
+def receiveFile(windowSize, receiverOptions, connection):
+    recvSocket = RDTSocket(windowSize, "127.0.0.1", 0, **receiverOptions)
+    connection.send(recvSocket.socket.getsockname())
+    startCPUTime = time.thread_time_ns()
+    receivedFile = recvSocket.recvFile()
+    connection.send(receivedFile)
+    connection.send({
+        "cpuTime": (time.thread_time_ns() - startCPUTime) / 1e9,
+        "datagramsSent": recvSocket.stats.datagramsSent,
+        "invalidDatagrams": recvSocket.stats.invalidDatagrams,
+        "packetsRecovered": recvSocket.session.stats.packetsRecovered,
+    })
+
+# Sends fileData over loopback to a receiver in another process, or in a thread of this process if inProcess is True
+# impairment is the Impairment.Impairment.parse spec applied to the datagrams each side receives; "" is a clean link
+# Returns the completion time (excluding the receiver's close), the CPU time of each side, the sender's packet counts and
+# smoothed RTT, and the number of datagrams each side sent
+def runTransfer(fileData, windowSize, impairment, senderOptions = {}, receiverOptions = {}, inProcess = False) -> dict:
+    senderOptions = dict({"inbound": impairment}, **senderOptions)
+    receiverOptions = dict({"inbound": impairment}, **receiverOptions)
+    (connection, childConnection) = multiprocessing.Pipe()
+    if inProcess:
+        receiver = threading.Thread(target = receiveFile, args = (windowSize, receiverOptions, childConnection))
+    else:
+        receiver = multiprocessing.Process(target = receiveFile, args = (windowSize, receiverOptions, childConnection))
+
+    receiver.start()
+    address = connection.recv()
+    sendSocket = RDTSocket(windowSize, **senderOptions)
+    startTime = time.perf_counter_ns()
+    startCPUTime = time.thread_time_ns()
+    sendSocket.send(fileData, address)
+    elapsed = time.perf_counter_ns() - startTime
+    cpuTime = time.thread_time_ns() - startCPUTime
+
+    received = connection.recv()
+    receiverCounts = connection.recv()
+    receiver.join()
+    if received != fileData:
+        raise Exception("runTransfer: the received file does not match the sent file")
+    session = sendSocket.session
+    return {
+        "time": elapsed / 1e9,
+        "cpuTime": cpuTime / 1e9,
+        "receiverCPUTime": receiverCounts["cpuTime"],
+        "packetsSent": session.stats.packetsSent,
+        "packetsRetransmitted": session.stats.packetsRetransmitted,
+        "bytesRetransmitted": session.stats.bytesRetransmitted,
+        "bytesSent": session.stats.bytesSent,
+        "parityBytesSent": session.stats.parityBytesSent,
+        "packetsRecovered": receiverCounts["packetsRecovered"],
+        "payloadSize": session.payloadSize,
+        "srtt": session.rtt.srtt / 1e9 if session.rtt.srtt != None else None,
+        "datagramsSent": sendSocket.stats.datagramsSent,
+        "acksSent": receiverCounts["datagramsSent"],
+        "invalidDatagrams": sendSocket.stats.invalidDatagrams + receiverCounts["invalidDatagrams"],
+    }
+
+# Compares retransmitted bytes and completion time with and without selective ACKs at several loss rates (in each direction)
+# The fixed window is used so that congestion control does not hide the difference in loss recovery
+def benchmarkSack(size = 8 * 10**4, windowSize = 32, lossRates = (.1, .2, .3)):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    printRow("loss rate", "ACKs", "time (s)", "packets sent", "retransmitted bytes")
+    for lossRate in lossRates:
+        for selectiveAck in [False, True]:
+            result = runTransfer(fileData, windowSize, f"loss={lossRate},seed=1", {"selectiveAck": selectiveAck, "congestionControl": "fixed"}, {"selectiveAck": selectiveAck})
+            printRow(lossRate, "SACK" if selectiveAck else "cumulative", f"{result['time']:.2f}", result["packetsSent"], result["bytesRetransmitted"])
+
+# Compares transfers with and without forward error correction at several loss rates and group sizes, over a 20 ms RTT link
+# The overhead is the PARITY bytes as a share of the bytes sent; every packet rebuilt from parity is one retransmission saved
+def benchmarkFEC(size = 5 * 10**5, windowSize = 64, lossRates = (.01, .05, .1), groupSizes = (0, 16, 8, 4)):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    printRow("loss rate", "FEC group", "time (s)", "retransmitted", "rebuilt", "overhead")
+    for lossRate in lossRates:
+        for groupSize in groupSizes:
+            result = runTransfer(fileData, windowSize, f"loss={lossRate},latency=10,seed=1", {"fecGroup": groupSize})
+            overhead = result["parityBytesSent"] / (result["parityBytesSent"] + result["bytesSent"])
+            printRow(lossRate, groupSize if groupSize > 0 else "off", f"{result['time']:.2f}", result["packetsRetransmitted"], result["packetsRecovered"], f"{overhead:.1%}")
+
+# Compares how many ACKs the receiver sends, and the CPU time the sender spends on them, as more in-order packets share an ACK
+def benchmarkAcks(size = 2 * 10**6, windowSize = 64, ackCounts = (1, 2, 4, 8), lossRates = (0, .01)):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    printRow("loss rate", "ACK every", "time (s)", "ACKs sent", "ACKs/packet", "sender CPU (s)")
+    for lossRate in lossRates:
+        for ackEvery in ackCounts:
+            result = runTransfer(fileData, windowSize, f"loss={lossRate},seed=1" if lossRate > 0 else "", {}, {"ackEvery": ackEvery})
+            printRow(lossRate, ackEvery, f"{result['time']:.2f}", result["acksSent"], f"{result['acksSent'] / result['packetsSent']:.2f}", f"{result['cpuTime']:.2f}")
+
+# Returns size bytes of log lines with random fields, which compress about as well as real logs
+def sampleLog(size, seed = 1) -> bytes:
+    rng = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        line = f"2026-10-18 12:{rng.randrange(60):02d}:{rng.randrange(60):02d}.{rng.randrange(1000):03d} INFO session {rng.randrange(1000)}: sent packet {rng.randrange(10**6)} size {rng.randrange(1400)} window {rng.randrange(64)}\n".encode()
+        lines.append(line)
+        length += len(line)
+    return b"".join(lines)[:size]
+
+# Compares the goodput (file bytes per second) of transfers with and without zlib compression
+# A compressible log file and random bytes are each sent over loopback and over a 10 Mbit/s link
+def benchmarkCompression(size = 2 * 10**6, windowSize = 64):
+    inputs = [("log", sampleLog(size)), ("random", random.Random(1).randbytes(size))]
+    links = [("loopback", ""), ("10 Mbit/s", "rate=10M,seed=1")]
+    printRow("input", "link", "compression", "time (s)", "goodput (MB/s)", "packets sent", "sender CPU (s)")
+    for ((inputName, fileData), (linkName, impairment)) in itertools.product(inputs, links):
+        for compression in (None, "zlib"):
+            result = runTransfer(fileData, windowSize, impairment, {"compression": compression})
+            printRow(inputName, linkName, compression or "off", f"{result['time']:.2f}", f"{size / result['time'] / 1e6:.2f}", result["packetsSent"], f"{result['cpuTime']:.2f}")
+
+# Measures the CPU time used by a socket waiting for packets that never arrive, and by a lossless transfer
+def benchmarkIdle(waitTime = 2e9, size = 10**5, windowSize = 32):
+    idleSocket = RDTSocket(windowSize, "127.0.0.1", 0, inbound = "")
+    startCPUTime = time.process_time_ns()
+    idleSocket.recv(time.monotonic_ns() + waitTime)
+    idleCPUTime = time.process_time_ns() - startCPUTime
+
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    result = runTransfer(fileData, windowSize, "")
+    printRow("", "wall time (s)", "CPU time (s)", "CPU use")
+    printRow("idle socket", f"{waitTime / 1e9:.2f}", f"{idleCPUTime / 1e9:.3f}", f"{idleCPUTime / waitTime:.1%}")
+    printRow("sender", f"{result['time']:.2f}", f"{result['cpuTime']:.3f}", f"{result['cpuTime'] / result['time']:.1%}")
+
+# Runs many transfers at the same time over loopback on one asyncio event loop
+# Every transfer has its own receiver and sender endpoint; there are no simulated failures
+def benchmarkAsync(transfers = 128, size = 2 * 10**4, windowSize = 32):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+
+    async def transfer():
+        receiver = AsyncRDTSocket(windowSize, "127.0.0.1", 0)
+        address = await receiver.listen()
+        (received, _) = await asyncio.gather(receiver.recv_file(), AsyncRDTSocket(windowSize).send(fileData, address))
+        receiver.close()
+        if received != fileData:
+            raise Exception("benchmarkAsync: the received file does not match the sent file")
+
+    async def run():
+        await asyncio.gather(*[transfer() for _ in range(transfers)])
+
+    startTime = time.perf_counter_ns()
+    startCPUTime = time.process_time_ns()
+    asyncio.run(run())
+    elapsed = (time.perf_counter_ns() - startTime) / 1e9
+    cpuTime = (time.process_time_ns() - startCPUTime) / 1e9
+
+    printRow("transfers", "file size (bytes)", "wall time (s)", "CPU time (s)", "throughput (MB/s)")
+    printRow(transfers, size, f"{elapsed:.2f}", f"{cpuTime:.2f}", f"{transfers * size / elapsed / 1e6:.2f}")
+
+# Sends messages small messages one after another, first each over its own connection, then all over one persistent connection
+# The persistent connection saves a START handshake and the close of each connection per message
+def benchmarkPersistent(messages = 256, size = 1000, windowSize = 32):
+    payloads = [bytes([i % 256]) * size for i in range(messages)]
+
+    async def separate():
+        for payload in payloads:
+            receiver = AsyncRDTSocket(windowSize, "127.0.0.1", 0)
+            address = await receiver.listen()
+            (received, _) = await asyncio.gather(receiver.recv_file(), AsyncRDTSocket(windowSize).send(payload, address))
+            receiver.close()
+            if received != payload:
+                raise Exception("benchmarkPersistent: a received message does not match the sent message")
+
+    async def persistent():
+        receiver = AsyncRDTSocket(windowSize, "127.0.0.1", 0)
+        address = await receiver.listen(messages = True)
+        sender = AsyncRDTSocket(windowSize)
+
+        async def send():
+            await sender.connect(address)
+            for payload in payloads:
+                await sender.send_message(payload)
+                await sender.flush()
+            await sender.shutdown()
+
+        async def receive():
+            received = []
+            while (message := await receiver.recv_message()) != None:
+                received.append(message)
+            return received
+
+        (received, _) = await asyncio.gather(receive(), send())
+        receiver.close()
+        if received != payloads:
+            raise Exception("benchmarkPersistent: the received messages do not match the sent messages")
+
+    printRow("connections", "messages", "size (bytes)", "wall time (s)", "messages/s")
+    for (name, run) in (("one per message", separate), ("persistent", persistent)):
+        startTime = time.perf_counter_ns()
+        asyncio.run(run())
+        elapsed = (time.perf_counter_ns() - startTime) / 1e9
+        printRow(name, messages, size, f"{elapsed:.2f}", f"{messages / elapsed:.0f}")
+
+# Sends a file over loopback striped across 1 to 8 connections, each sender and receiver stream in its own process
+# Goodput should grow with the streams until the cores (or the loopback) run out
+def benchmarkStreams(size = 2 * 10**7, windowSize = 64, streamCounts = (1, 2, 4, 8)):
+    options = {"inbound": ""}
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "source")
+        with open(source, "wb") as f:
+            for _ in range(size // len(sampleText)):
+                f.write(sampleText)
+            f.write(sampleText[:size % len(sampleText)])
+
+        printRow("streams", "file size (bytes)", "time (s)", "goodput (MB/s)", "speedup")
+        baseline = None
+        for streams in streamCounts:
+            destination = os.path.join(directory, f"destination-{streams}")
+            ready = threading.Event()
+            addresses = []
+
+            def onReady(bound):
+                addresses.extend(bound)
+                ready.set()
+
+            receiver = threading.Thread(target = Striping.recvStriped, args = (destination, [("127.0.0.1", 0)] * streams, windowSize, options, onReady))
+            receiver.start()
+            ready.wait()
+            startTime = time.perf_counter_ns()
+            Striping.sendStriped(source, addresses, windowSize, options)
+            elapsed = (time.perf_counter_ns() - startTime) / 1e9
+            receiver.join()
+
+            with open(source, "rb") as f, open(destination, "rb") as g:
+                if f.read() != g.read():
+                    raise Exception(f"benchmarkStreams: the file received over {streams} streams does not match the sent file")
+            baseline = baseline or elapsed
+            printRow(streams, size, f"{elapsed:.2f}", f"{size / elapsed / 1e6:.2f}", f"{baseline / elapsed:.2f}x")
+
+# Streams files of increasing size from disk through a sender and a receiver session connected in memory
+# The peak memory allocated during the transfer should not grow with the file size
+def benchmarkMemory(sizes = (10**6, 10**7, 10**8), windowSize = 64):
+    printRow("file size (bytes)", "time (s)", "peak memory (KB)")
+    for size in sizes:
+        with tempfile.TemporaryFile() as source, open(os.devnull, "wb") as sink:
+            for _ in range(size // len(sampleText)):
+                source.write(sampleText)
+            source.write(sampleText[:size % len(sampleText)])
+            source.seek(0)
+
+            tracemalloc.start()
+            startTime = time.perf_counter_ns()
+            receiver = transferInMemory(source, windowSize, sink)
+            elapsed = time.perf_counter_ns() - startTime
+            (_, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            if receiver.stats.bytesReceived != size:
+                raise Exception(f"benchmarkMemory: received {receiver.stats.bytesReceived} of {size} bytes")
+            printRow(size, f"{elapsed / 1e9:.2f}", f"{peak / 1e3:.0f}")
+
+# Sends source through a sender session to a receiver session that writes it to sink, passing packets between them directly
+# Returns the receiver session once it has the whole file
+def transferInMemory(source, windowSize, sink = None):
+    sender = Session.SenderSession(source, windowSize, "fixed")
+    packets = sender.transmit(0)
+    receiver = Session.ReceiverSession(packets[0], windowSize, sink = sink)
+    while not receiver.complete:
+        for packet in receiver.transmit(0):
+            sender.receive(packet, 0)
+        for packet in sender.transmit(0):
+            receiver.receive(packet, 0)
+    return receiver
+
+# Measures what the event trace and the debug log cost per packet by transferring fileData between sessions in memory
+# The debug log is written to a null handler, so only the cost of building the messages is measured
+def benchmarkTrace(size = 10**7, windowSize = 64):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    sessionLog = logging.getLogger(Session.__name__)
+    configurations = [
+        ("off", False, logging.WARNING),
+        ("trace", True, logging.WARNING),
+        ("debug log", False, logging.DEBUG),
+    ]
+    printRow("", "time (s)", "ns/packet", "events recorded")
+    for (name, trace, level) in configurations:
+        if trace:
+            Metrics.startTrace()
+        (previousLevel, previousPropagate) = (sessionLog.level, sessionLog.propagate)
+        sessionLog.setLevel(level)
+        sessionLog.propagate = False
+        handler = logging.NullHandler()
+        sessionLog.addHandler(handler)
+        try:
+            startTime = time.perf_counter_ns()
+            receiver = transferInMemory(fileData, windowSize)
+            elapsed = time.perf_counter_ns() - startTime
+        finally:
+            sessionLog.removeHandler(handler)
+            sessionLog.setLevel(previousLevel)
+            sessionLog.propagate = previousPropagate
+            stopped = Metrics.stopTrace()
+        if receiver.receivedFile != fileData:
+            raise Exception("benchmarkTrace: the received file does not match the sent file")
+        packets = receiver.stats.packetsReceived
+        printRow(name, f"{elapsed / 1e9:.2f}", f"{elapsed / packets:.0f}", stopped.recorded if stopped != None else 0)
+
+# Shows how many datagrams a 1 MB file takes and the goodput of a lossless transfer for several datagram sizes
+# The smaller sizes are the payloads the protocol used to have: 100 characters, then a quarter of a 1400 byte datagram
+def benchmarkMTU(size = 10**6, windowSize = 64):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    receiverOptions = {"maxDatagramSize": Utility.UnreliableSocket.maxUdpPayload}
+    configurations = [
+        ("100 byte payload", {"maxDatagramSize": 100 + Utility.PacketCodec.header.size}),
+        ("346 byte payload", {"maxDatagramSize": 346 + Utility.PacketCodec.header.size}),
+        ("1400 byte datagram", {}),
+        ("path MTU", {"probeMTU": True}),
+    ]
+    printRow("datagrams", "payload (bytes)", "datagrams/MB", "time (s)", "goodput (MB/s)")
+    for (name, senderOptions) in configurations:
+        result = runTransfer(fileData, windowSize, "", dict(senderOptions, congestionControl = "fixed"), receiverOptions)
+        printRow(name, result["payloadSize"], f"{result['packetsSent'] * 10**6 / size:.0f}", f"{result['time']:.2f}", f"{size / result['time'] / 1e6:.2f}")
+
+# Measures the goodput of a transfer over links with different impairments, applied in both directions with the same seed
+def benchmarkLink(size = 10**6, windowSize = 64, congestionControl = "aimd"):
+    fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+    links = [
+        ("clean", ""),
+        ("1% loss", "loss=0.01,seed=1"),
+        ("bursty loss", "ge=0.01:0.3,seed=1"),
+        ("20 ms RTT, jitter", "latency=10,jitter=2,seed=1"),
+        ("10 Mbit/s, 64 KB queue", "rate=10M,queue=65536,seed=1"),
+        ("5% reordered", "reorder=0.05,seed=1"),
+        ("bit errors (1e-6)", "ber=1e-6,seed=1"),
+    ]
+    printRow("link", "time (s)", "goodput (MB/s)", "packets sent", "retransmitted")
+    for (name, impairment) in links:
+        result = runTransfer(fileData, windowSize, impairment, {"congestionControl": congestionControl})
+        printRow(name, f"{result['time']:.2f}", f"{size / result['time'] / 1e6:.2f}", result["packetsSent"], result["packetsRetransmitted"])
+
+# Describes the code and machine a sweep ran on, so results from different commits can be told apart
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, check = True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output = True, text = True, check = True).stdout != ""
+    except (OSError, subprocess.CalledProcessError):
+        (commit, dirty) = (None, None)
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+# Identifies the settings of a sweep result, to match results between sweeps
+def configurationKey(result) -> tuple:
+    return (result["payload"], result["window"], result["size"], result["impairment"], result["congestion"], result["inProcess"])
+
+# Runs a transfer for every combination of payload size, window size, file size and impairment, repeat times each
+# Prints one row per transfer and writes every result, with the environment it ran in, as JSON to the --json file
+# The rows go to standard error if the JSON goes to standard output
+def benchmarkSweep(arguments):
+    parser = argparse.ArgumentParser(prog = "benchmark.py sweep", description = "Sweep transfer settings over loopback and report goodput, latency and retransmission overhead")
+    parser.add_argument("--payload", type = int, nargs = "+", default = [346, Session.Session.packetPayloadSize], metavar = "BYTES", help = "DATA payload sizes")
+    parser.add_argument("--window", type = int, nargs = "+", default = [16, 64], metavar = "PACKETS", help = "window sizes")
+    parser.add_argument("--size", type = lambda value: int(float(value)), nargs = "+", default = [10**5, 10**6], metavar = "BYTES", help = "file sizes (1e6 is allowed)")
+    parser.add_argument("--impairment", nargs = "+", default = ["", "loss=0.01,seed=1"], metavar = "SPEC", help = "Impairment.Impairment.parse specs applied to the datagrams each side receives (\"\" for a clean link)")
+    parser.add_argument("--congestion", default = "aimd", help = "sender congestion controller (default: aimd)")
+    parser.add_argument("--repeat", type = int, default = 1, help = "transfers per combination (default: 1)")
+    parser.add_argument("--in-process", action = "store_true", help = "run the receiver in a thread instead of a separate process")
+    parser.add_argument("--json", metavar = "FILE", help = "write the results to FILE (- for standard output)")
+    args = parser.parse_args(arguments)
+
+    results = []
+    table = contextlib.redirect_stdout(sys.stderr) if args.json == "-" else contextlib.nullcontext()
+    with table:
+        printRow("payload (bytes)", "window", "file size (bytes)", "impairment", "time (s)", "goodput (MB/s)", "srtt (ms)", "datagrams", "retransmitted", "CPU (s)")
+        for (payload, windowSize, size, impairment, _) in itertools.product(args.payload, args.window, args.size, args.impairment, range(args.repeat)):
+            fileData = (sampleText * (size // len(sampleText) + 1))[:size]
+            transfer = runTransfer(fileData, windowSize, impairment,
+                {"maxDatagramSize": payload + Utility.PacketCodec.header.size, "congestionControl": args.congestion},
+                {"maxDatagramSize": Utility.UnreliableSocket.maxUdpPayload}, args.in_process)
+            result = {
+                "payload": payload,
+                "window": windowSize,
+                "size": size,
+                "impairment": impairment,
+                "congestion": args.congestion,
+                "inProcess": args.in_process,
+                "goodput": size / transfer["time"],
+                "retransmissionRatio": transfer["packetsRetransmitted"] / transfer["packetsSent"],
+            }
+            result.update(transfer)
+            results.append(result)
+            printRow(payload, windowSize, size, impairment if impairment != "" else "clean", f"{transfer['time']:.3f}", f"{result['goodput'] / 1e6:.2f}",
+                f"{transfer['srtt'] * 1e3:.2f}" if transfer["srtt"] != None else "-", transfer["datagramsSent"], f"{result['retransmissionRatio']:.1%}",
+                f"{transfer['cpuTime'] + transfer['receiverCPUTime']:.3f}")
+
+    if args.json != None:
+        report = {"environment": environment(), "results": results}
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent = 2)
+            print()
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent = 2)
+
+# Compares the goodput of two sweeps (benchmark.py sweep --json) for the settings both ran, using the median of the repeats
+# Exits with status 1 if the goodput of any setting dropped by more than the tolerance
+def benchmarkCompare(arguments):
+    parser = argparse.ArgumentParser(prog = "benchmark.py compare", description = "Compare two sweeps and report goodput regressions")
+    parser.add_argument("baseline", help = "JSON file from an earlier sweep")
+    parser.add_argument("current", help = "JSON file from the sweep to check")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "largest drop in goodput that is not a regression (default: 0.2)")
+    args = parser.parse_args(arguments)
+
+    sweeps = []
+    for path in (args.baseline, args.current):
+        with open(path) as f:
+            report = json.load(f)
+        byConfiguration = {}
+        for result in report["results"]:
+            byConfiguration.setdefault(configurationKey(result), []).append(result)
+        sweeps.append(byConfiguration)
+    (baseline, current) = sweeps
+
+    regressions = 0
+    printRow("payload (bytes)", "window", "file size (bytes)", "impairment", "goodput (MB/s)", "was (MB/s)", "change", "retransmitted", "was")
+    for key in sorted(baseline.keys() & current.keys()):
+        (goodput, previousGoodput) = (statistics.median(result["goodput"] for result in results) for results in (current[key], baseline[key]))
+        (ratio, previousRatio) = (statistics.median(result["retransmissionRatio"] for result in results) for results in (current[key], baseline[key]))
+        change = goodput / previousGoodput - 1
+        regressed = change < -args.tolerance
+        regressions += regressed
+        (payload, windowSize, size, impairment, _, _) = key
+        printRow(payload, windowSize, size, impairment if impairment != "" else "clean", f"{goodput / 1e6:.2f}", f"{previousGoodput / 1e6:.2f}",
+            f"{change:+.1%}" + (" REGRESSION" if regressed else ""), f"{ratio:.1%}", f"{previousRatio:.1%}")
+
+    unmatched = len(baseline.keys() ^ current.keys())
+    if unmatched > 0:
+        print(f"{unmatched} settings were only run in one of the sweeps")
+    if regressions > 0:
+        print(f"{regressions} settings regressed by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+def main():
+    match sys.argv[1] if len(sys.argv) > 1 else "codec":
+        case "codec":
+            benchmarkCodec()
+        case "window":
+            benchmarkWindow()
+        case "sack":
+            benchmarkSack()
+        case "fec":
+            benchmarkFEC()
+        case "acks":
+            benchmarkAcks()
+        case "compression":
+            benchmarkCompression()
+        case "idle":
+            benchmarkIdle()
+        case "async":
+            benchmarkAsync()
+        case "persistent":
+            benchmarkPersistent()
+        case "streams":
+            benchmarkStreams()
+        case "memory":
+            benchmarkMemory()
+        case "mtu":
+            benchmarkMTU()
+        case "link":
+            benchmarkLink()
+        case "trace":
+            benchmarkTrace()
+        case "sweep":
+            benchmarkSweep(sys.argv[2:])
+        case "compare":
+            benchmarkCompare(sys.argv[2:])
+        case other:
+            raise Exception(f"Unknown benchmark: {other}")
+
+if __name__ == "__main__":
+    main()
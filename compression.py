@@ -0,0 +1,58 @@
+import zlib
+
+class Codec:
+
+    # Base class for the compression schemes a sender can propose in the START handshake
+    # The sender compresses everything it sends as one stream and cuts the result into DATA packets, so packets are still
+    # checked, buffered and retransmitted one by one; the receiver decompresses the stream once it has been put back in order
+    # Subclasses set id (1 to 255, sent in the compression handshake option) and return the stream objects:
+    #   compressor(): compress(data) returns the compressed bytes it can output so far, and flush() returns the rest of
+    #                 everything passed to compress, so the receiver can decompress all of it; the stream carries on after a flush
+    #   decompressor(): decompress(data) returns the bytes data completes
+    id = None
+
+    def compressor(self):
+        pass
+
+    def decompressor(self):
+        pass
+
+class ZlibCompressor:
+
+    # A zlib stream whose flush ends at a byte boundary without ending the stream
+    def __init__(self, level):
+        self.stream = zlib.compressobj(level)
+
+    def compress(self, data) -> bytes:
+        return self.stream.compress(data)
+
+    def flush(self) -> bytes:
+        return self.stream.flush(zlib.Z_SYNC_FLUSH)
+
+class ZlibCodec(Codec):
+
+    # DEFLATE with a 32 KB window; the level trades CPU time for compression (1 is fastest, 9 is smallest)
+    id = 1
+    level = 6
+
+    def compressor(self):
+        return ZlibCompressor(ZlibCodec.level)
+
+    def decompressor(self):
+        return zlib.decompressobj()
+
+# Codecs that can be selected by name
+codecs = {
+    "zlib": ZlibCodec,
+}
+codecIds = {codec.id: codec for codec in codecs.values()} # The same codecs by the id sent in the handshake
+
+# Returns the codec named compression (a name from codecs or a Codec subclass), or None if compression is None
+def create(compression) -> Codec:
+    if compression == None:
+        return None
+    if isinstance(compression, str):
+        if compression not in codecs:
+            raise Exception(f"Unknown compression: {compression}. Choose from {', '.join(codecs)}")
+        compression = codecs[compression]
+    return compression()
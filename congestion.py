@@ -0,0 +1,100 @@
+class CongestionController:
+
+    # Base class for the congestion controllers used by RDTSocket.send
+    # Subclasses adjust self.cwnd (in packets) in response to ACK and loss events
+    def __init__(self, maxWindow):
+        self.maxWindow = maxWindow # Largest window the controller will ever use
+        self.cwnd = maxWindow      # Congestion window in packets; may be fractional
+
+    # Returns how many packets may be in the window, bounded by the window the receiver advertised
+    def window(self, receiverWindow) -> int:
+        return max(1, min(int(self.cwnd), self.maxWindow, receiverWindow))
+
+    # Returns the earliest time (ns) the next packet may be sent
+    def sendTime(self):
+        return 0
+
+    # Returns True if a packet may be sent at time now (ns)
+    def canSend(self, now) -> bool:
+        return now >= self.sendTime()
+
+    # Called when a packet is sent at time now (ns)
+    def onSend(self, now):
+        pass
+
+    # Called when an ACK advances the window by newlyAcked packets
+    # rtt is the smoothed round trip time in ns, or None if it has not been measured yet
+    def onAck(self, newlyAcked, rtt, now):
+        pass
+
+    # Called when a packet is lost; timeout is True for retransmission timeouts and False for fast retransmits
+    def onLoss(self, timeout, now):
+        pass
+
+class FixedWindow(CongestionController):
+
+    # Always uses the full window (the behavior before congestion control was added)
+    pass
+
+class AIMD(CongestionController):
+
+    # Slow start followed by additive increase, multiplicative decrease (TCP Reno)
+    def __init__(self, maxWindow):
+        CongestionController.__init__(self, maxWindow)
+        self.cwnd = 1                # Start with one packet in flight
+        self.ssthresh = maxWindow    # Slow start threshold
+
+    def onAck(self, newlyAcked, rtt, now):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += newlyAcked               # Slow start: grow by one packet per ACKed packet
+        else:
+            self.cwnd += newlyAcked / self.cwnd   # Congestion avoidance: grow by about one packet per RTT
+        self.cwnd = min(self.cwnd, self.maxWindow)
+
+    def onLoss(self, timeout, now):
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = 1 if timeout else self.ssthresh
+
+class RateBased(CongestionController):
+
+    initialRate = 100 # Packets per second before any ACKs are received
+    minRate = 10      # Lowest rate the controller will back off to
+    rateIncrease = 10 # Packets per second added for every ACKed packet
+    rateDecrease = .5 # Factor the rate is multiplied by when a packet is lost
+
+    # Paces packets at a rate that grows additively with ACKs and shrinks multiplicatively with losses
+    # maxWindow still bounds the number of packets in flight
+    def __init__(self, maxWindow):
+        CongestionController.__init__(self, maxWindow)
+        self.rate = RateBased.initialRate
+        self.nextSendTime = 0 # Earliest time (ns) the next packet may be sent
+
+    def sendTime(self):
+        return self.nextSendTime
+
+    def onSend(self, now):
+        self.nextSendTime = max(self.nextSendTime, now) + 1e9 / self.rate
+
+    def onAck(self, newlyAcked, rtt, now):
+        self.rate += RateBased.rateIncrease * newlyAcked
+        # Keep enough packets in flight to sustain the rate over one round trip
+        if rtt != None:
+            self.cwnd = max(1, self.rate * rtt / 1e9 * 2)
+
+    def onLoss(self, timeout, now):
+        self.rate = max(self.rate * RateBased.rateDecrease, RateBased.minRate)
+
+# Congestion controllers that can be selected by name
+controllers = {
+    "fixed": FixedWindow,
+    "aimd": AIMD,
+    "rate": RateBased,
+}
+
+# Create a congestion controller from a name in controllers or a CongestionController subclass
+def create(congestionControl, maxWindow) -> CongestionController:
+    if isinstance(congestionControl, str):
+        if congestionControl not in controllers:
+            raise Exception(f"Unknown congestion control: {congestionControl}. Choose from {', '.join(controllers)}")
+        congestionControl = controllers[congestionControl]
+    return congestionControl(maxWindow)
@@ -0,0 +1,148 @@
+import struct
+import utility as Utility
+
+# Forward error correction with XOR parity
+# The packets after START are split into groups of groupSize consecutive sequence numbers, and after the last packet of each
+# group is first sent, a PARITY packet carries the XOR of the whole group. A receiver that is missing exactly one packet of a
+# group can rebuild it from the parity and the others, without waiting for it to be retransmitted
+# Each packet is protected as a block: type (1 byte) | payload length (2 bytes) | payload, so END and MESSAGE packets and
+# short DATA packets can be rebuilt too. Blocks are XORed as little endian integers, which pads the shorter ones with zeros
+# The PARITY payload is the number of packets in the group (2 bytes) followed by the XOR of their blocks
+blockHeader = struct.Struct("!BH")
+parityHeader = struct.Struct("!H")
+overhead = blockHeader.size + parityHeader.size # Bytes a PARITY payload can take beyond the largest DATA payload
+maxGroupSize = 255                               # Largest group size the fecGroup handshake option can carry
+
+# Returns the block of packet as an integer and its length in bytes
+def block(packet):
+    payload = packet.payload if packet.payload != None else b""
+    data = blockHeader.pack(packet.packetHeader.type, len(payload)) + payload
+    return (int.from_bytes(data, "little"), len(data))
+
+class ParityEncoder:
+
+    # Builds the PARITY packets of a sender whose first packet after START is firstSeqNum
+    def __init__(self, firstSeqNum, groupSize):
+        self.firstSeqNum = firstSeqNum
+        self.groupSize = groupSize
+        self.nextSeqNum = firstSeqNum # The packet the current group expects next
+        self.parity = 0               # XOR of the blocks of the current group so far
+        self.length = 0               # Length of the longest of those blocks
+        self.count = 0                # Packets in the current group so far
+
+    # Add a packet the first time it is sent; packets must be added in sequence order
+    # Returns the PARITY packet of the group once its last packet has been added (or END, which ends the last group early)
+    def add(self, packet):
+        seq_num = packet.packetHeader.seq_num
+        if seq_num != self.nextSeqNum: # Only whole groups are protected
+            self.parity = 0
+            self.length = 0
+            self.count = 0
+        self.nextSeqNum = seq_num + 1
+        if self.count == 0 and (seq_num - self.firstSeqNum) % self.groupSize != 0:
+            return None
+        (value, length) = block(packet)
+        self.parity ^= value
+        self.length = max(self.length, length)
+        self.count += 1
+        if self.count < self.groupSize and packet.packetHeader.type != 1:
+            return None
+        parityPacket = Utility.Packet.newParityPacket(seq_num - self.count + 1, parityHeader.pack(self.count) + self.parity.to_bytes(self.length, "little"))
+        self.parity = 0
+        self.length = 0
+        self.count = 0
+        return parityPacket
+
+class ParityGroup:
+
+    __slots__ = ("parity", "length", "received", "offsets", "count", "done")
+
+    def __init__(self):
+        self.parity = 0     # XOR of the blocks received and the parity, once it arrives
+        self.length = 0     # Length of the XOR in the PARITY packet: the longest block of the group
+        self.received = 0   # Packets of the group received
+        self.offsets = 0    # Sum of their offsets from the start of the group, which leaves the offset of the only missing one
+        self.count = None   # Packets in the group; None until the PARITY packet arrives
+        self.done = False   # True once nothing more can be rebuilt from the group
+
+class ParityDecoder:
+
+    # Rebuilds the lost packets of a sender whose first packet after START is firstSeqNum
+    # Keeps one ParityGroup for each group the receiver window has not passed, so memory does not grow with the file
+    def __init__(self, firstSeqNum, groupSize):
+        self.firstSeqNum = firstSeqNum
+        self.groupSize = groupSize
+        self.groups = {}                 # First sequence number of the group -> ParityGroup
+        self.discardedUpTo = firstSeqNum # The groups below this have been dropped
+
+    # Returns the first sequence number of the group seq_num is in
+    def groupStart(self, seq_num) -> int:
+        return seq_num - (seq_num - self.firstSeqNum) % self.groupSize
+
+    # Add a packet the first time it is received; duplicates must not be added
+    # Returns the packet it lets the decoder rebuild, or None
+    def add(self, packet):
+        seq_num = packet.packetHeader.seq_num
+        start = self.groupStart(seq_num)
+        group = self.group(start)
+        if group == None:
+            return None
+        group.parity ^= block(packet)[0]
+        group.received += 1
+        group.offsets += seq_num - start
+        return self.recover(start, group)
+
+    # Add a PARITY packet; returns the packet it lets the decoder rebuild, or None
+    def addParity(self, packet):
+        start = packet.packetHeader.seq_num
+        group = self.group(start)
+        payload = packet.payload
+        if group == None or group.count != None or start != self.groupStart(start) or len(payload) < parityHeader.size:
+            return None
+        (group.count,) = parityHeader.unpack_from(payload)
+        group.parity ^= int.from_bytes(payload[parityHeader.size:], "little")
+        group.length = len(payload) - parityHeader.size
+        return self.recover(start, group)
+
+    # Returns the group that starts at start, creating it if needed, or None if it was dropped or is done
+    def group(self, start):
+        if start < self.discardedUpTo:
+            return None
+        group = self.groups.get(start)
+        if group == None:
+            group = self.groups[start] = ParityGroup()
+        return group if not group.done else None
+
+    # Returns the missing packet of a group if the parity has arrived and it is the only packet missing, otherwise None
+    def recover(self, start, group):
+        if group.count == None or group.received < group.count - 1:
+            return None
+        group.done = True
+        if group.received >= group.count:
+            return None
+        count = group.count
+        seq_num = start + count * (count - 1) // 2 - group.offsets
+        size = max(group.length, blockHeader.size)
+        if group.parity.bit_length() > 8 * size: # The parity does not match the packets, so nothing can be rebuilt
+            return None
+        data = group.parity.to_bytes(size, "little")
+        (type, length) = blockHeader.unpack_from(data)
+        payload = data[blockHeader.size:blockHeader.size + length]
+        if len(payload) != length:
+            return None
+        match type:
+            case 1:
+                return Utility.Packet.newEndPacket(seq_num)
+            case 2:
+                return Utility.Packet.newDataPacket(seq_num, payload)
+            case 4:
+                return Utility.Packet.newMessagePacket(seq_num)
+        return None
+
+    # Drop the groups that lie entirely below seq_num, the receiver window position
+    def discardBelow(self, seq_num):
+        if seq_num - self.discardedUpTo < self.groupSize:
+            return
+        self.discardedUpTo = self.groupStart(seq_num)
+        for start in [start for start in self.groups if start < self.discardedUpTo]:
+            del self.groups[start]
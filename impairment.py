@@ -0,0 +1,161 @@
+import random, heapq
+
+class BernoulliLoss:
+
+    # Drops every datagram independently with probability loss
+    def __init__(self, loss):
+        self.loss = loss
+
+    # Returns True if the next datagram is lost
+    def lost(self, rng) -> bool:
+        return rng.random() < self.loss
+
+class GilbertElliottLoss:
+
+    # Bursty loss from a two state Markov chain
+    # Before each datagram the link moves from the good to the bad state with probability p and back with probability r
+    # Datagrams are then lost with probability lossGood or lossBad depending on the state
+    def __init__(self, p, r, lossBad = 1, lossGood = 0):
+        self.p = p
+        self.r = r
+        self.lossBad = lossBad
+        self.lossGood = lossGood
+        self.bad = False # The link starts in the good state
+
+    def lost(self, rng) -> bool:
+        if rng.random() < (self.r if self.bad else self.p):
+            self.bad = not self.bad
+        return rng.random() < (self.lossBad if self.bad else self.lossGood)
+
+class Impairment:
+
+    # Simulates an unreliable link in one direction by deciding when, if ever, each datagram comes out of it and what it looks like
+    # It works on the encoded datagrams, so corruption can hit any bit of the header or payload
+    # Every random choice comes from one random.Random seeded with seed, so a run can be repeated exactly
+    #   lossModel:    BernoulliLoss, GilbertElliottLoss or None for no loss
+    #   latency:      one-way delay (ns) added to every datagram; jitter is the standard deviation (ns) of a normal variation of it
+    #                 Jitter never lets a datagram overtake the one before it; only reorder does
+    #   rate:         link bandwidth in bits per second; datagrams queue behind each other at this rate. None is unlimited
+    #   queueSize:    bytes that can wait for the link before datagrams are dropped (drop-tail). None is unlimited
+    #   reorder:      probability that a datagram is held back by reorderDelay (ns) so the ones behind it overtake it
+    #   corrupt:      probability that one random bit of a datagram is flipped
+    #   bitErrorRate: probability that any one bit is flipped; applied as one flipped bit per damaged datagram
+    def __init__(self, seed = None, lossModel = None, latency = 0, jitter = 0, rate = None, queueSize = None, reorder = 0, reorderDelay = 1e7, corrupt = 0, bitErrorRate = 0):
+        self.rng = random.Random(seed)
+        self.lossModel = lossModel
+        self.latency = latency
+        self.jitter = jitter
+        self.rate = rate
+        self.queueSize = queueSize
+        self.reorder = reorder
+        self.reorderDelay = reorderDelay
+        self.corrupt = corrupt
+        self.bitErrorRate = bitErrorRate
+
+        self.linkFreeAt = 0  # When (ns) the link has finished sending the datagrams already queued on it
+        self.lastDelivery = 0 # When (ns) the last datagram that was not reordered comes out of the link
+        self.inFlight = []   # Min-heap of (delivery time, count, data, address)
+        self.count = 0       # Breaks ties between datagrams delivered at the same time
+
+        self.datagrams = 0   # Datagrams put on the link
+        self.lost = 0        # Datagrams dropped by the loss model
+        self.queueDrops = 0  # Datagrams dropped because the queue was full
+        self.corrupted = 0   # Datagrams with a flipped bit
+        self.reordered = 0   # Datagrams held back to be reordered
+
+    # Parse a comma separated list of settings, for example "loss=0.05,latency=20,jitter=5,rate=10M,seed=1"
+    #   loss=P             Bernoulli loss
+    #   ge=P:R[:BAD[:GOOD]] Gilbert-Elliott loss (see GilbertElliottLoss)
+    #   latency=MS, jitter=MS, reorder=P, reorderdelay=MS
+    #   rate=BITS/S (k, M and G suffixes are allowed), queue=BYTES
+    #   corrupt=P, ber=P, seed=N
+    # Returns None for an empty spec
+    @classmethod
+    def parse(cls, spec):
+        if spec == None or spec.strip() == "":
+            return None
+        settings = {}
+        for setting in spec.split(","):
+            if "=" not in setting:
+                raise Exception(f"Impairment.parse: expected name=value, got {setting!r}")
+            (name, value) = (part.strip() for part in setting.split("=", 1))
+            match name.lower():
+                case "seed":
+                    settings["seed"] = int(value)
+                case "loss":
+                    settings["lossModel"] = BernoulliLoss(float(value))
+                case "ge":
+                    settings["lossModel"] = GilbertElliottLoss(*(float(part) for part in value.split(":")))
+                case "latency":
+                    settings["latency"] = float(value) * 1e6
+                case "jitter":
+                    settings["jitter"] = float(value) * 1e6
+                case "rate":
+                    multiplier = {"k": 1e3, "m": 1e6, "g": 1e9}.get(value[-1].lower(), None)
+                    settings["rate"] = float(value[:-1]) * multiplier if multiplier != None else float(value)
+                case "queue":
+                    settings["queueSize"] = int(value)
+                case "reorder":
+                    settings["reorder"] = float(value)
+                case "reorderdelay":
+                    settings["reorderDelay"] = float(value) * 1e6
+                case "corrupt":
+                    settings["corrupt"] = float(value)
+                case "ber":
+                    settings["bitErrorRate"] = float(value)
+                case other:
+                    raise Exception(f"Impairment.parse: unknown setting {other!r}")
+        return cls(**settings)
+
+    # Put a datagram on the link at time now (ns)
+    def put(self, data, address, now):
+        self.datagrams += 1
+        rng = self.rng
+        if self.lossModel != None and self.lossModel.lost(rng):
+            self.lost += 1
+            return
+
+        # Wait for the datagrams ahead of it, then take the time needed to send it at the link rate
+        departure = now
+        if self.rate != None:
+            start = max(now, self.linkFreeAt)
+            if self.queueSize != None and (start - now) * self.rate / 8e9 > self.queueSize:
+                self.queueDrops += 1
+                return
+            departure = start + len(data) * 8e9 / self.rate
+            self.linkFreeAt = departure
+
+        delivery = departure + self.latency
+        if self.jitter > 0:
+            delivery = max(departure, delivery + rng.gauss(0, self.jitter), self.lastDelivery)
+        if self.reorder > 0 and rng.random() < self.reorder:
+            delivery += self.reorderDelay
+            self.reordered += 1
+        else:
+            self.lastDelivery = delivery
+
+        # Flip a bit anywhere in the datagram
+        corruptChance = self.corrupt
+        if self.bitErrorRate > 0:
+            corruptChance = 1 - (1 - corruptChance) * (1 - self.bitErrorRate) ** (len(data) * 8)
+        if corruptChance > 0 and len(data) > 0 and rng.random() < corruptChance:
+            damaged = bytearray(data)
+            bit = rng.randrange(len(damaged) * 8)
+            damaged[bit // 8] ^= 1 << (bit % 8)
+            data = bytes(damaged)
+            self.corrupted += 1
+
+        heapq.heappush(self.inFlight, (delivery, self.count, data, address))
+        self.count += 1
+
+    # Returns when (ns) the next datagram comes out of the link, or None if the link is empty
+    def nextDeadline(self):
+        return self.inFlight[0][0] if len(self.inFlight) > 0 else None
+
+    # Returns the (data, address) pairs that have come out of the link by time now (ns), in order of arrival
+    def take(self, now) -> list:
+        delivered = []
+        while len(self.inFlight) > 0 and self.inFlight[0][0] <= now:
+            (_, _, data, address) = heapq.heappop(self.inFlight)
+            delivered.append((data, address))
+        return delivered
@@ -0,0 +1,154 @@
+import collections, json
+
+class Histogram:
+
+    # Counts values in power of two buckets: bucket i holds the values from 2**(i-1) to 2**i - 1 (bucket 0 holds 0)
+    # Recording a value is one list update, so it can be used on every packet
+    def __init__(self):
+        self.buckets = [0] * 65
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = int(value)
+        self.buckets[min(value.bit_length(), 64)] += 1
+        self.count += 1
+        self.total += value
+        if self.min == None or value < self.min:
+            self.min = value
+        if self.max == None or value > self.max:
+            self.max = value
+
+    # Returns the upper bound of the bucket that holds the fraction p of the values, or None if nothing was recorded
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        seen = 0
+        for (i, count) in enumerate(self.buckets):
+            seen += count
+            if seen >= p * self.count:
+                return min(2**i - 1, self.max)
+        return self.max
+
+    def asDict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count > 0 else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(.5),
+            "p90": self.percentile(.9),
+            "p99": self.percentile(.99),
+            "buckets": {f"<{2**i}": count for (i, count) in enumerate(self.buckets) if count > 0},
+        }
+
+class Stats:
+
+    # Counters of a socket or session; subclasses set them all to 0 in __init__
+    # Counters are plain attributes so that updating one costs no more than an addition
+    def asDict(self) -> dict:
+        return {name: value.asDict() if isinstance(value, Histogram) else value for (name, value) in vars(self).items()}
+
+class SenderStats(Stats):
+
+    def __init__(self):
+        self.startsSent = 0           # START packets sent, including retransmissions
+        self.packetsSent = 0          # DATA and END packets sent, including retransmissions
+        self.bytesSent = 0            # Bytes in the packets sent
+        self.uncompressedBytes = 0    # Bytes of the source passed to the compressor, if compression was agreed on
+        self.packetsRetransmitted = 0 # Packets sent more than once
+        self.bytesRetransmitted = 0   # Bytes in the retransmitted packets
+        self.acksReceived = 0
+        self.duplicateAcks = 0        # ACKs that did not advance the window
+        self.packetsAcked = 0         # Packets removed from the window by cumulative ACKs
+        self.packetsSacked = 0        # Packets reported by SACK blocks before they were ACKed
+        self.parityPacketsSent = 0    # PARITY packets sent for FEC
+        self.parityBytesSent = 0      # Bytes in the PARITY packets
+        self.timeouts = 0             # Retransmission timer expiries
+        self.fastRetransmits = 0      # Retransmissions triggered by duplicate ACKs
+        self.rtt = Histogram()        # Round trip time samples in µs
+        self.windowOccupancy = Histogram() # Packets between the window base and each packet sent, including it
+
+class ReceiverStats(Stats):
+
+    def __init__(self):
+        self.packetsReceived = 0      # Valid packets received or rebuilt from parity, including duplicates
+        self.bytesReceived = 0        # Payload bytes delivered in order, after decompression
+        self.compressedBytes = 0      # Payload bytes decompressed, if compression was agreed on
+        self.duplicatePackets = 0     # Packets that had already been received
+        self.outOfOrderPackets = 0    # Packets buffered because one before them was missing
+        self.outsideWindow = 0        # Packets beyond the receiver window, which are dropped
+        self.parityReceived = 0       # PARITY packets received for FEC
+        self.packetsRecovered = 0     # Lost packets rebuilt from parity instead of being retransmitted
+        self.messagesReceived = 0     # Messages ended by a MESSAGE packet, and any unended one before END
+        self.acksSent = 0
+        self.delayedAcks = 0          # ACKs sent by the delayed ACK timer rather than by a packet
+        self.bufferOccupancy = Histogram() # Packets waiting in the buffer after each packet is processed
+
+class SocketStats(Stats):
+
+    def __init__(self):
+        self.datagramsSent = 0        # Datagrams passed to sendto, including any the outbound impairment drops
+        self.bytesSent = 0            # Bytes in those datagrams
+        self.datagramsReceived = 0    # Datagrams that came out of the inbound impairment
+        self.bytesReceived = 0        # Bytes in those datagrams
+        self.invalidDatagrams = 0     # Datagrams dropped because they were corrupted or malformed
+
+class Trace:
+
+    # Names of the values recorded with each event, in order
+    fields = {
+        "start": ("attempt", "rto"),
+        "handshake": ("payloadSize",),
+        "send": ("seq", "size", "transmission", "occupancy", "window"),
+        "ack": ("seq", "window", "sackBlocks", "newlyAcked", "rtt"),
+        "timeout": ("rto", "retransmit"),
+        "fastRetransmit": ("retransmit",),
+        "parity": ("seq", "size"),
+        "rebuilt": ("seq", "type"),
+        "receive": ("seq", "type", "buffered", "ack"),
+        "complete": ("packets",),
+        "delivered": ("bytes",),
+        "closed": (),
+        "invalid": ("size",),
+        "evicted": ("address",),
+    }
+
+    # Keeps the last capacity protocol events in memory, to be written out as JSON lines with dump
+    # Recording an event only appends a tuple to a bounded deque, so a trace can be left on for normal transfers
+    # Enable it for every socket and session with startTrace
+    def __init__(self, capacity = 65536):
+        self.events = collections.deque(maxlen = capacity)
+        self.recorded = 0 # Events recorded, including those that have fallen out of the buffer
+
+    # Record event (a name from Trace.fields) of session (its start sequence number) at time now (ns)
+    # values are the values named in Trace.fields, relative sequence numbers in the case of seq
+    def record(self, now, event, session, *values):
+        self.events.append((now, event, session, values))
+        self.recorded += 1
+
+    # Write the events in the buffer to the text file f, oldest first, one JSON object per line
+    def dump(self, f):
+        for (now, event, session, values) in self.events:
+            line = {"t": now, "event": event, "session": session}
+            line.update(zip(Trace.fields[event], values))
+            f.write(json.dumps(line) + "\n")
+
+    def clear(self):
+        self.events.clear()
+
+trace = None # The Trace events are recorded in, or None if tracing is off
+
+# Start recording events in a new trace with room for capacity events and return it
+def startTrace(capacity = 65536) -> Trace:
+    global trace
+    trace = Trace(capacity)
+    return trace
+
+# Stop recording events; returns the trace, which keeps the events recorded so far
+def stopTrace() -> Trace:
+    global trace
+    (stopped, trace) = (trace, None)
+    return stopped
@@ -1,21 +1,96 @@
-import sys
+import argparse, logging, json
 from RDTSocket import RDTSocket
+from RDTServer import RDTServer
+import utility as Utility
+import metrics as Metrics
+import session as Session
+import striping as Striping
 
 localIP = "127.0.0.1"
 
 def main():
+    # Read the command line arguments
+    parser = argparse.ArgumentParser(description = "Receive a file from an RDT sender and save it to download.txt")
+    parser.add_argument("port", type = int, help = "port to receive on")
+    parser.add_argument("windowSize", type = int, help = "receiver window size (in packets)")
+    parser.add_argument("--server", action = "store_true", help = "keep receiving files from any number of senders, saving them to download-1.txt, download-2.txt, ...")
+    parser.add_argument("--max-datagram", type = int, default = Utility.UnreliableSocket.maxDatagramSize, help = f"largest datagram to accept in bytes (default: {Utility.UnreliableSocket.maxDatagramSize})")
+    parser.add_argument("--impair-in", default = None, metavar = "SPEC", help = f"impairment of the datagrams received, e.g. loss=0.05,latency=20,seed=1; see Impairment.Impairment.parse (default: {Utility.UnreliableSocket.defaultImpairment}; \"\" for none)")
+    parser.add_argument("--impair-out", default = None, metavar = "SPEC", help = "impairment of the datagrams sent (default: none)")
+    parser.add_argument("--max-sessions", type = int, default = 64, help = "most senders served at the same time with --server (default: 64)")
+    parser.add_argument("--log-level", choices = ["debug", "info", "warning", "error"], default = "info", help = "least severe messages to print; debug prints every packet (default: info)")
+    parser.add_argument("--trace", metavar = "FILE", help = "record protocol events and write the last ones to FILE as JSON lines")
+    parser.add_argument("--stats", action = "store_true", help = "print the transfer counters as JSON when done")
+    parser.add_argument("--ack-every", type = int, default = Session.ReceiverSession.ackEvery, metavar = "N", help = f"ACK in-order packets together, N at a time; 1 ACKs every packet (default: {Session.ReceiverSession.ackEvery})")
+    parser.add_argument("--ack-delay", type = float, default = Session.ReceiverSession.ackDelay / 1e6, metavar = "MS", help = f"longest time an in-order packet waits to be ACKed (default: {Session.ReceiverSession.ackDelay / 1e6:g})")
+    parser.add_argument("--streams", type = int, default = 1, help = "receive a file split over this many connections by sender.py --streams, on port, port + 1, ... (default: 1)")
+    args = parser.parse_args()
+    if args.streams < 1:
+        parser.error("--streams must be at least 1")
+    if args.ack_every < 1:
+        parser.error("--ack-every must be at least 1")
+    if args.streams > 1 and (args.server or args.trace != None):
+        parser.error("--server and --trace cannot be used with --streams")
+    logging.basicConfig(level = args.log_level.upper(), format = "%(message)s")
+    if args.trace != None:
+        Metrics.startTrace()
+
+    try:
+        if args.server:
+            serve(args)
+        elif args.streams > 1:
+            receiveStriped(args)
+        else:
+            receive(args)
+    finally:
+        if args.trace != None:
+            with open(args.trace, "w") as f:
+                Metrics.trace.dump(f)
+
+# Receive one file
+def receive(args):
     # Set up the socket
-    recvSocket = RDTSocket(int(sys.argv[2]), localIP, int(sys.argv[1]))
-    
-    # Receive the file
-    fileString = recvSocket.recvFile()
-    
-    # Export the contents
-    with open("download.txt", "w") as f:
-        f.write(fileString)
-    
+    recvSocket = RDTSocket(args.windowSize, localIP, args.port, maxDatagramSize = args.max_datagram, inbound = args.impair_in, outbound = args.impair_out, ackEvery = args.ack_every, ackDelay = args.ack_delay * 1e6)
+
+    # Receive the file, writing the contents as they arrive
+    with open("download.txt", "wb") as f:
+        recvSocket.recvFile(f)
+
     # Complete
     print("File downloaded")
-    
+    if args.stats:
+        print(json.dumps(recvSocket.statistics(), indent = 2))
+
+# Receive one file over args.streams connections at the same time
+def receiveStriped(args):
+    options = {"maxDatagramSize": args.max_datagram, "inbound": args.impair_in, "outbound": args.impair_out, "ackEvery": args.ack_every, "ackDelay": args.ack_delay * 1e6}
+    stats = Striping.recvStriped("download.txt", [(localIP, args.port + i) for i in range(args.streams)], args.windowSize, options)
+    print("File downloaded")
+    if args.stats:
+        print(json.dumps(stats, indent = 2))
+
+# Receive files until interrupted
+def serve(args):
+    downloads = 0
+
+    # Write the contents of each file as they arrive
+    def openSink(address):
+        nonlocal downloads
+        downloads += 1
+        return open(f"download-{downloads}.txt", "wb")
+
+    def onFile(address, f):
+        f.close()
+        print(f"File from ({address[0]}, {address[1]}) downloaded to {f.name}")
+
+    server = RDTServer(args.windowSize, localIP, args.port, onFile, maxSessions = args.max_sessions, openSink = openSink, maxDatagramSize = args.max_datagram, inbound = args.impair_in, outbound = args.impair_out, ackEvery = args.ack_every, ackDelay = args.ack_delay * 1e6)
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    if args.stats:
+        print(json.dumps({"socket": server.stats.asDict(), "filesReceived": server.table.filesReceived, "sessionsEvicted": server.table.sessionsEvicted}, indent = 2))
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,20 +1,65 @@
-import sys
+import argparse, logging, json
 from RDTSocket import RDTSocket
+import congestion as Congestion
+import compression as Compression
+import utility as Utility
+import metrics as Metrics
+import striping as Striping
 
 def main():
-    # Read the file
-    fileString = ""
-    with open("alice.txt", "r") as f:
-        fileString = "".join(f.readlines())
+    # Read the command line arguments
+    parser = argparse.ArgumentParser(description = "Send alice.txt to an RDT receiver")
+    parser.add_argument("ip", help = "receiver ip")
+    parser.add_argument("port", type = int, help = "receiver port")
+    parser.add_argument("windowSize", type = int, help = "largest sender window size (in packets)")
+    parser.add_argument("--congestion", choices = Congestion.controllers, default = "aimd", help = "congestion control algorithm (default: aimd)")
+    parser.add_argument("--max-datagram", type = int, default = Utility.UnreliableSocket.maxDatagramSize, help = f"largest datagram to send in bytes (default: {Utility.UnreliableSocket.maxDatagramSize})")
+    parser.add_argument("--impair-in", default = None, metavar = "SPEC", help = f"impairment of the datagrams received, e.g. loss=0.05,latency=20,seed=1; see Impairment.Impairment.parse (default: {Utility.UnreliableSocket.defaultImpairment}; \"\" for none)")
+    parser.add_argument("--impair-out", default = None, metavar = "SPEC", help = "impairment of the datagrams sent (default: none)")
+    parser.add_argument("--probe-mtu", action = "store_true", help = "size datagrams to the path MTU to the receiver instead of --max-datagram (Linux only)")
+    parser.add_argument("--log-level", choices = ["debug", "info", "warning", "error"], default = "info", help = "least severe messages to print; debug prints every packet (default: info)")
+    parser.add_argument("--trace", metavar = "FILE", help = "record protocol events and write the last ones to FILE as JSON lines")
+    parser.add_argument("--stats", action = "store_true", help = "print the transfer counters as JSON when done")
+    parser.add_argument("--fec", type = int, default = 0, metavar = "K", help = "send a PARITY packet after every K packets so the receiver can rebuild one lost packet per group without a retransmission (default: 0, off)")
+    parser.add_argument("--compress", choices = Compression.codecs, default = None, help = "compress the file as it is sent, if the receiver supports the codec (default: off)")
+    parser.add_argument("--streams", type = int, default = 1, help = "split the file over this many connections, sent from separate processes to port, port + 1, ... (default: 1)")
+    args = parser.parse_args()
+    if args.streams < 1:
+        parser.error("--streams must be at least 1")
+    if args.streams > 1 and args.trace != None:
+        parser.error("--trace cannot be used with --streams")
+    logging.basicConfig(level = args.log_level.upper(), format = "%(message)s")
+    if args.trace != None:
+        Metrics.startTrace()
     
+    if args.streams > 1:
+        sendStriped(args)
+        return
+
     # Set up the socket
-    sendSocket = RDTSocket(int(sys.argv[3]))
+    sendSocket = RDTSocket(args.windowSize, congestionControl = args.congestion, maxDatagramSize = args.max_datagram, probeMTU = args.probe_mtu, inbound = args.impair_in, outbound = args.impair_out, fecGroup = args.fec, compression = args.compress)
     
-    # Send the file
-    sendSocket.send(fileString, (sys.argv[1], int(sys.argv[2])))
+    # Send the file; it is read as the window advances
+    try:
+        with open("alice.txt", "rb") as f:
+            sendSocket.send(f, (args.ip, args.port))
+    finally:
+        if args.trace != None:
+            with open(args.trace, "w") as f:
+                Metrics.trace.dump(f)
     
     # Complete
     print("File Sent")
+    if args.stats:
+        print(json.dumps(sendSocket.statistics(), indent = 2))
+
+# Send the file over args.streams connections at the same time
+def sendStriped(args):
+    options = {"congestionControl": args.congestion, "maxDatagramSize": args.max_datagram, "probeMTU": args.probe_mtu, "inbound": args.impair_in, "outbound": args.impair_out, "fecGroup": args.fec, "compression": args.compress}
+    stats = Striping.sendStriped("alice.txt", [(args.ip, args.port + i) for i in range(args.streams)], args.windowSize, options)
+    print("File Sent")
+    if args.stats:
+        print(json.dumps(stats, indent = 2))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
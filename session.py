@@ -0,0 +1,790 @@
+import random, heapq, io, logging, collections
+import utility as Utility
+import window as Window
+import congestion as Congestion
+import metrics as Metrics
+import fec as Fec
+import compression as Compression
+
+log = logging.getLogger(__name__)
+
+class Session:
+
+    waitTime = 5e8 # How long (in ns) to wait before retransmitting until the RTT has been measured. Currently set to 500 ms
+    # Largest DATA payload (in bytes) unless a larger one is negotiated: fills a datagram of the default size
+    packetPayloadSize = Utility.UnreliableSocket.maxDatagramSize - Utility.PacketCodec.header.size
+
+    # The protocol state of one transfer, kept apart from the socket it runs over so that RDTSocket and RDTProtocol can share it
+    # A session never touches the network itself. Whatever drives it:
+    #   - passes every valid packet received from the other side to receive(packet, now)
+    #   - sends the packets returned by transmit(now) to the other side
+    #   - calls transmit(now) again when nextDeadline() passes, until finished is True
+    # now is always time.monotonic_ns()
+    def __init__(self, windowSize, selectiveAck):
+        self.windowSize = windowSize     # Largest window size in packets
+        self.selectiveAck = selectiveAck # Send (receiver) or use (sender) SACK blocks in ACKs
+        self.startSeqNum = -1            # -1 because it has not been set yet
+        self.timers = Utility.TimerQueue() # Every timer the session is waiting on
+        self.outbox = []                 # Packets waiting to be returned by transmit
+        self.complete = False            # True once the file has been delivered
+        self.finished = False            # True once the session has nothing left to send or wait for
+        self.stats = None                # Metrics.Stats of the session, set by subclasses
+
+    # Returns when (time.monotonic_ns) transmit should next be called, or None if only a packet can move the session forward
+    def nextDeadline(self):
+        return self.timers.nextDeadline()
+
+    # Handle a valid packet from the other side
+    def receive(self, packet, now):
+        pass
+
+    # Fire the timers that have expired and return the packets that should be sent now
+    def transmit(self, now) -> list:
+        self.timers.runExpired(now)
+        self.onTimers(now)
+        packets = self.outbox
+        self.outbox = []
+        return packets
+
+    # Called by transmit after the expired timers are marked as fired
+    def onTimers(self, now):
+        pass
+
+    # Returns the options this side sends in the START handshake; see Utility.PacketCodec.handshakeOptions
+    def handshakeOptions(self) -> dict:
+        return {}
+
+class SenderSession(Session):
+
+    fastRetransmitThreshold = 3 # Number of duplicate ACKs that trigger a retransmission before the timeout
+    compressionBlock = 2**16    # Bytes of the source passed to the compressor at a time
+
+    # Sends source: START handshake, then the data packets, then the END packet
+    # source is a binary file object, which is read as the window advances, or bytes, bytearray, mmap or str (sent as UTF-8)
+    # If source is None the connection stays open after the handshake: messages are sent with queueMessage until close is called
+    # congestionControl is a name from Congestion.controllers or a Congestion.CongestionController subclass
+    # rtt is the Window.RTTEstimator to use; sessions to the same receiver can share one to keep what it has measured
+    # maxPayloadSize is the largest DATA payload (in bytes) the sender can send; the receiver may lower it in the handshake
+    # fecGroup is the number of packets per PARITY packet to propose in the handshake (see fec.py); 0 turns FEC off
+    # compression is a name from Compression.codecs or a Compression.Codec subclass to propose in the handshake; None sends data as is
+    def __init__(self, source, windowSize, congestionControl = "aimd", selectiveAck = True, rtt = None, maxPayloadSize = None, fecGroup = 0, compression = None):
+        Session.__init__(self, windowSize, selectiveAck)
+        self.startSeqNum = random.randint(0, 2**30)
+        self.connected = False              # True once START has been ACKed
+        self.senderWindowPos = 1            # Window position tracks where the start of the window is, relative to startSeqNum
+        self.advertisedWindow = windowSize  # Receiver window size from the most recent ACK
+        self.rtt = rtt if rtt != None else Window.RTTEstimator(Session.waitTime) # Retransmission timeout measured from ACKs
+
+        self.maxPayloadSize = maxPayloadSize if maxPayloadSize != None else Session.packetPayloadSize
+        self.payloadSize = None       # DATA payload size agreed on in the handshake
+        if fecGroup < 0 or fecGroup > Fec.maxGroupSize:
+            raise Exception(f"SenderSession: fecGroup must be from 0 to {Fec.maxGroupSize}")
+        self.fecGroup = fecGroup      # Packets per PARITY packet; 0 once the handshake is done if the receiver did not accept FEC
+        self.parityEncoder = None     # Fec.ParityEncoder if FEC was agreed on
+        self.codec = Compression.create(compression) # None once the handshake is done if the receiver did not accept it
+        self.compressor = None        # The compression stream of the connection, if compression was agreed on
+
+        # Packets are created lazily as the window advances, so only the packets in the window are held in memory
+        # The window is created once the payload size is known
+        self.window = None
+        self.queue = collections.deque() # (source, marked) of the messages that have not been read yet; see packets
+        self.closing = False          # True once END should follow the queued messages
+        self.messagesQueued = 0       # Messages passed to queueMessage (or source)
+        self.messagesRead = 0         # Messages whose last packet has been pulled into the window
+        self.messagesAcked = 0        # Messages the receiver has all of
+        self.messageEnds = collections.deque() # For each message read but not ACKed: the sequence number after its last packet
+        if source != None:
+            self.queue.append((source, False)) # A single file is ended by END alone, so it goes over the wire as before
+            self.messagesQueued = 1
+            self.close()
+        self.controller = Congestion.create(congestionControl, windowSize)
+
+        self.stats = Metrics.SenderStats()
+
+        self.startAttempts = 0        # Number of START packets sent
+        self.startTime = None         # When the last START packet was sent
+        self.startTimer = None        # Retransmits START
+        self.retransmitTimer = None   # Retransmits the oldest packet that has not been ACKed
+        self.pacingTimer = None       # Wakes the sender when the congestion controller allows the next packet
+
+    # Yields the packets used to send source (see __init__) in sequence order, ending with the END packet
+    # Each data packet carries at most size bytes
+    @staticmethod
+    def splitIntoPackets(source, startSeqNum, size = Session.packetPayloadSize):
+        seq_num = startSeqNum + 1
+        for chunk in SenderSession.chunks(source, size):
+            yield Utility.Packet.newDataPacket(seq_num, chunk)
+            seq_num += 1
+        yield Utility.Packet.newEndPacket(seq_num)
+
+    # Yields the contents of source (see __init__) in pieces of at most size bytes
+    @staticmethod
+    def chunks(source, size):
+        if isinstance(source, str):
+            source = source.encode("utf-8")
+        if hasattr(source, "read"): # File objects (and mmap) are read one packet at a time
+            return iter(lambda: source.read(size), b"")
+        view = memoryview(source)   # Only the slice for each packet is copied out of buffers
+        return (bytes(view[i:i+size]) for i in range(0, len(view), size))
+
+    # Yields the packets of the queued messages in sequence order: the DATA packets of each message followed by a MESSAGE packet
+    # Yields None while nothing is queued, and the END packet once the session is closing and every message has been read
+    def packets(self):
+        seq_num = self.startSeqNum + 1
+        while True:
+            if len(self.queue) > 0:
+                (source, marked) = self.queue[0]
+                chunks = SenderSession.chunks(source, self.payloadSize) if self.compressor == None else self.compressedChunks(source)
+                for chunk in chunks:
+                    yield Utility.Packet.newDataPacket(seq_num, chunk)
+                    seq_num += 1
+                self.queue.popleft()
+                self.messagesRead += 1
+                self.messageEnds.append(seq_num + 1 if marked else seq_num)
+                if marked:
+                    yield Utility.Packet.newMessagePacket(seq_num)
+                    seq_num += 1
+            elif self.closing:
+                yield Utility.Packet.newEndPacket(seq_num)
+                return
+            else:
+                yield None
+
+    # Yields source (see __init__) compressed, in pieces of at most payloadSize bytes
+    # The compressor is flushed at the end of source so the receiver can decompress all of it before the MESSAGE or END packet
+    def compressedChunks(self, source):
+        size = self.payloadSize
+        compressed = bytearray()
+        for chunk in SenderSession.chunks(source, SenderSession.compressionBlock):
+            self.stats.uncompressedBytes += len(chunk)
+            compressed += self.compressor.compress(chunk)
+            while len(compressed) >= size:
+                yield bytes(compressed[:size])
+                del compressed[:size]
+        compressed += self.compressor.flush()
+        for i in range(0, len(compressed), size):
+            yield bytes(compressed[i:i + size])
+
+    # Send source (see __init__) as the next message on a connection opened without a source
+    # The receiver gets it as one message; nothing is sent until the handshake is done
+    def queueMessage(self, source):
+        if self.closing:
+            raise Exception("SenderSession.queueMessage: the connection is closing")
+        self.queue.append((source, True))
+        self.messagesQueued += 1
+
+    # Send END once the queued messages have been sent; the session finishes when it is ACKed
+    def close(self):
+        self.closing = True
+
+    def onTimers(self, now):
+        if self.finished:
+            return
+
+        # Send START message; retransmit it if ACK is not received in time
+        if not self.connected:
+            if self.startTimer == None or self.startTimer.fired:
+                if self.startTimer != None:
+                    self.rtt.backoff()
+                self.outbox.append(Utility.Packet.newStartPacket(self.startSeqNum, self.handshakeOptions()))
+                self.startAttempts += 1
+                self.startTime = now
+                self.startTimer = self.timers.schedule(now + self.rtt.rto)
+                self.stats.startsSent += 1
+                log.info("Sent START packet")
+                trace = Metrics.trace
+                if trace != None:
+                    trace.record(now, "start", self.startSeqNum, self.startAttempts, self.rtt.rto)
+            return
+
+        # Timeout: retransmit the oldest packet that has not been ACKed (and any other holes reported by SACK)
+        # Nothing was lost if the oldest packet is still waiting to be sent; the timer is started again when it is sent
+        if self.retransmitTimer != None and self.retransmitTimer.fired and not self.window.baseInFlight():
+            self.retransmitTimer = None
+        if self.retransmitTimer != None and self.retransmitTimer.fired:
+            self.rtt.backoff()
+            self.retransmitTimer = self.timers.schedule(now + self.rtt.rto)
+            retransmit = self.retransmitMissing()
+            self.controller.onLoss(True, now)
+            self.stats.timeouts += 1
+            log.debug("Timeout: %s scheduled to be retransmitted; RTO %.0f ms", [i - self.startSeqNum for i in retransmit], self.rtt.rto / 1e6)
+            trace = Metrics.trace
+            if trace != None:
+                trace.record(now, "timeout", self.startSeqNum, self.rtt.rto, len(retransmit))
+
+        # Send every packet the window and the congestion controller allow, smallest sequence number first
+        window = self.window
+        stats = self.stats
+        trace = Metrics.trace
+        while True:
+            window.windowSize = self.controller.window(self.advertisedWindow)
+            if not window.hasPending():
+                break
+            if not self.controller.canSend(now): # Wake up when the controller allows the next packet
+                self.timers.cancel(self.pacingTimer)
+                self.pacingTimer = self.timers.schedule(self.controller.sendTime())
+                break
+            packetToSend = window.nextToSend()
+            seq_num = packetToSend.packetHeader.seq_num
+            if self.retransmitTimer == None: # Nothing was in flight
+                self.retransmitTimer = self.timers.schedule(now + self.rtt.rto)
+            self.outbox.append(packetToSend)
+            transmissions = window.markSent(seq_num, now)
+            self.controller.onSend(now)
+            payload = packetToSend.payload
+            packetSize = Utility.PacketCodec.header.size + (len(payload) if payload != None else 0) # DATA and END packets carry no SACK blocks or options
+            occupancy = seq_num - window.base + 1
+            stats.packetsSent += 1
+            stats.bytesSent += packetSize
+            stats.windowOccupancy.record(occupancy)
+            if transmissions > 1:
+                stats.packetsRetransmitted += 1
+                stats.bytesRetransmitted += packetSize
+            log.debug("Sent P%04d Size: %05d", seq_num - self.startSeqNum, packetSize)
+            if trace != None:
+                trace.record(now, "send", self.startSeqNum, seq_num - self.startSeqNum, packetSize, transmissions, occupancy, window.windowSize)
+            if transmissions == 1 and self.parityEncoder != None: # Protect the group once its last packet has been sent
+                parityPacket = self.parityEncoder.add(packetToSend)
+                if parityPacket != None:
+                    self.outbox.append(parityPacket)
+                    paritySize = Utility.PacketCodec.header.size + len(parityPacket.payload)
+                    stats.parityPacketsSent += 1
+                    stats.parityBytesSent += paritySize
+                    if trace != None:
+                        trace.record(now, "parity", self.startSeqNum, parityPacket.packetHeader.seq_num - self.startSeqNum, paritySize)
+
+    def receive(self, packet, now):
+        if self.finished or packet.packetHeader.type != 3: # Only ACKs are sent to the sender
+            return
+        seq_num = packet.packetHeader.seq_num
+        self.advertisedWindow = packet.packetHeader.window
+
+        # Wait for the ACK of START before sending anything else
+        if not self.connected:
+            if seq_num == self.startSeqNum:
+                self.timers.cancel(self.startTimer)
+                if self.startAttempts == 1: # The handshake only gives an RTT sample if START was not retransmitted
+                    self.rtt.sample(now - self.startTime)
+                self.connected = True
+                self.onHandshake(packet.options)
+                log.info("START ACK received; payload size %d bytes", self.payloadSize)
+                trace = Metrics.trace
+                if trace != None:
+                    trace.record(now, "handshake", self.startSeqNum, self.payloadSize)
+            return
+
+        log.debug("Received ACK%04d", seq_num - self.startSeqNum)
+        window = self.window
+        stats = self.stats
+        stats.acksReceived += 1
+
+        # Stop packets the receiver already has from being retransmitted
+        newlySacked = window.sack(packet.sack) if self.selectiveAck else []
+        stats.packetsSacked += len(newlySacked)
+
+        # Update the retransmission timeout
+        rtt = window.rttSample(seq_num, now, newlySacked)
+        if rtt != None:
+            self.rtt.sample(rtt)
+            stats.rtt.record(rtt // 1000)
+
+        # Remove ACKed packets from the window and advance it if necessary
+        newlyAcked = window.ack(seq_num)
+        trace = Metrics.trace
+        if trace != None:
+            trace.record(now, "ack", self.startSeqNum, seq_num - self.startSeqNum, packet.packetHeader.window, len(packet.sack), newlyAcked, rtt)
+        if newlyAcked > 0:
+            stats.packetsAcked += newlyAcked
+            self.senderWindowPos = window.base - self.startSeqNum
+            self.rtt.restore()
+            self.timers.cancel(self.retransmitTimer) # Restart the timer when the window advances, or stop it if nothing is left in flight
+            self.retransmitTimer = self.timers.schedule(now + self.rtt.rto) if window.baseInFlight() else None
+            self.controller.onAck(newlyAcked, self.rtt.srtt, now)
+            messageEnds = self.messageEnds
+            while len(messageEnds) > 0 and messageEnds[0] <= window.base:
+                messageEnds.popleft()
+                self.messagesAcked += 1
+        else:
+            stats.duplicateAcks += 1
+            if window.duplicateAcks == SenderSession.fastRetransmitThreshold:
+                # Fast retransmit the packet the receiver is waiting for and any other holes reported by SACK
+                retransmit = self.retransmitMissing()
+                self.controller.onLoss(False, now)
+                stats.fastRetransmits += 1
+                log.debug("Fast retransmit %s", [i - self.startSeqNum for i in retransmit])
+                if trace != None:
+                    trace.record(now, "fastRetransmit", self.startSeqNum, len(retransmit))
+
+        # The END packet has been ACKed: confirm it, so the receiver can close without waiting for retransmissions
+        if window.isDone():
+            self.timers.cancel(self.retransmitTimer)
+            self.timers.cancel(self.pacingTimer)
+            self.outbox.append(Utility.Packet.newAckPacket(window.base))
+            self.complete = True
+            self.finished = True
+            log.info("Complete")
+            if trace != None:
+                trace.record(now, "complete", self.startSeqNum, stats.packetsAcked)
+
+    def handshakeOptions(self) -> dict:
+        options = {"maxPayload": self.maxPayloadSize}
+        if self.fecGroup > 0:
+            options["fecGroup"] = self.fecGroup
+        if self.codec != None:
+            options["compression"] = self.codec.id
+        return options
+
+    # Apply the options the receiver answered START with and start sending the queued messages
+    # FEC is used if the receiver answered with the same group size; DATA payloads then leave room for the PARITY header
+    # Compression is used if the receiver answered with the same codec
+    def onHandshake(self, options):
+        self.payloadSize = min(self.maxPayloadSize, options.get("maxPayload", Session.packetPayloadSize))
+        if self.fecGroup > 0 and options.get("fecGroup", 0) == self.fecGroup:
+            self.payloadSize -= Fec.overhead
+            self.parityEncoder = Fec.ParityEncoder(self.startSeqNum + 1, self.fecGroup)
+        else:
+            self.fecGroup = 0
+        if self.codec != None and options.get("compression") == self.codec.id:
+            self.compressor = self.codec.compressor()
+        else:
+            self.codec = None
+        self.window = Window.SendWindow(self.packets(), self.startSeqNum + 1, self.windowSize)
+
+    # Schedule the packets the receiver is known to be missing to be retransmitted
+    # Without SACK that is only the oldest packet that has not been ACKed
+    # Returns the sequence numbers of the packets that will be retransmitted
+    def retransmitMissing(self) -> list:
+        window = self.window
+        missing = [window.base]
+        if self.selectiveAck:
+            missing.extend(seq_num for seq_num in window.holes() if seq_num != window.base)
+        for seq_num in missing:
+            window.requeue(seq_num)
+        return missing
+
+class ReceiverSession(Session):
+
+    maxSackBlocks = 16               # Most SACK blocks sent in one ACK
+    lingerTime = Session.waitTime * 10 # How long to keep ACKing retransmissions after the END packet
+    writeBufferSize = 2**16          # In-order payloads are collected into a buffer of this many bytes before they are written to the sink
+    ackEvery = 2                     # Default number of in-order DATA packets covered by one ACK
+    ackDelay = 2e6                   # Default longest time (in ns) an in-order DATA packet waits to be ACKed. Currently set to 2 ms
+    quickAcks = 16                   # In-order DATA packets ACKed one by one at the start and whenever the delayed ACK timer fires
+
+    # Receives a file from the sender of startPacket (a START packet)
+    # The file is written to sink (anything with a write method that takes bytes) as it arrives in order
+    # Without a sink it is collected in memory and returned in receivedFile
+    # maxPayloadSize is the largest DATA payload (in bytes) the receiver accepts; the smaller of it and the sender's is used
+    # With messages, what arrives is split into the messages the sender queued (see SenderSession.queueMessage) instead
+    # Each is collected in memory and put on self.messages once all of it has arrived; there can be no sink
+    # Without messages, the messages of a connection are written to the sink one after another
+    # In-order DATA packets are ACKed together: once ackEvery of them have arrived, or ackDelay ns after the first of them
+    # Anything else (a gap, a duplicate, the packet that fills a gap, MESSAGE and END) is ACKed at once so loss recovery is not slowed
+    # While the sender's window is small (in slow start, or when the timer fires because nothing more came) every packet is ACKed
+    # ackEvery = 1 ACKs every packet; None uses the class defaults
+    def __init__(self, startPacket, windowSize, selectiveAck = True, sink = None, maxPayloadSize = None, messages = False, ackEvery = None, ackDelay = None):
+        Session.__init__(self, windowSize, selectiveAck)
+        self.startSeqNum = startPacket.packetHeader.seq_num           # Save the start sequence number for later use
+        self.receiverWindowPos = self.startSeqNum + 1                 # Lower bound (inclusive) of the receiver window: the next expected packet
+        self.targetAddress = startPacket.packetHeader.address         # Address of the sender
+        self.buffer = {}                 # Packets received out of order, by sequence number
+        self.collect = sink == None      # True if the file is collected in memory
+        self.sink = sink if sink != None else io.BytesIO()
+        self.writeBuffer = bytearray(ReceiverSession.writeBufferSize) # Reused for every write to the sink
+        self.writeBufferPos = 0          # Number of bytes in writeBuffer
+        self.stats = Metrics.ReceiverStats()
+        self.receivedFile = None         # The whole file (bytes) once the END packet has been processed, if there is no sink
+        if messages and sink != None:
+            raise Exception("ReceiverSession: messages are collected in memory, so there can be no sink")
+        self.splitMessages = messages
+        self.messages = collections.deque() # Messages (bytes) received in full that have not been taken yet, if splitMessages
+        self.lingerTimer = None          # Running while the session waits for retransmissions after the END packet
+        self.ackEvery = min(ackEvery if ackEvery != None else ReceiverSession.ackEvery, max(windowSize // 2, 1)) # A full window always gets an ACK
+        self.ackDelay = ackDelay if ackDelay != None else ReceiverSession.ackDelay
+        self.unacked = 0                 # In-order DATA packets received since the last ACK
+        self.quickAcksLeft = ReceiverSession.quickAcks # In-order DATA packets still to be ACKed one by one
+        self.ackTimer = None             # Sends the delayed ACK of those packets
+
+        # Agree on the handshake options and send ACK to start receiving the message
+        # FEC is accepted whenever the sender proposes it; it only costs the receiver one running XOR per group in the window
+        options = startPacket.options
+        self.payloadSize = min(options.get("maxPayload", Session.packetPayloadSize), maxPayloadSize if maxPayloadSize != None else Session.packetPayloadSize)
+        self.fecGroup = options.get("fecGroup", 0)
+        self.parityDecoder = Fec.ParityDecoder(self.startSeqNum + 1, self.fecGroup) if self.fecGroup > 0 else None
+        self.codec = Compression.codecIds.get(options.get("compression")) # Compression is accepted if the codec is known
+        self.decompressor = self.codec().decompressor() if self.codec != None else None
+        self.sendACK(self.startSeqNum, options = self.handshakeOptions())
+
+    def handshakeOptions(self) -> dict:
+        options = {"maxPayload": self.payloadSize}
+        if self.fecGroup > 0:
+            options["fecGroup"] = self.fecGroup
+        if self.codec != None:
+            options["compression"] = self.codec.id
+        return options
+
+    # Queue an ACK of seq_num, with the packets received beyond it as SACK blocks
+    def sendACK(self, seq_num, sack = (), options = None):
+        self.timers.cancel(self.ackTimer) # The ACK covers any delayed one
+        self.ackTimer = None
+        self.unacked = 0
+        self.outbox.append(Utility.Packet.newAckPacket(seq_num, self.windowSize, sack if self.selectiveAck else (), options))
+        self.stats.acksSent += 1
+        log.debug("Sent ACK%04d", seq_num - self.startSeqNum)
+
+    # Returns the SACK blocks for the packets in buffer above windowPos, lowest first
+    @staticmethod
+    def sackRanges(buffer, windowPos) -> list:
+        ranges = []
+        for seq_num in sorted(buffer):
+            if seq_num <= windowPos:
+                continue
+            if len(ranges) > 0 and ranges[-1][1] == seq_num: # Extend the current block
+                ranges[-1] = (ranges[-1][0], seq_num + 1)
+            elif len(ranges) < ReceiverSession.maxSackBlocks: # Start a new block
+                ranges.append((seq_num, seq_num + 1))
+            else:
+                break
+        return ranges
+
+    def onTimers(self, now):
+        if self.ackTimer != None and self.ackTimer.fired: # The sender is waiting for this ACK to send more
+            self.stats.delayedAcks += 1
+            self.quickAcksLeft = ReceiverSession.quickAcks
+            self.sendACK(self.receiverWindowPos, ReceiverSession.sackRanges(self.buffer, self.receiverWindowPos))
+        if self.lingerTimer != None and self.lingerTimer.fired:
+            self.close(now)
+
+    # Stop lingering: the sender will not re-send anything
+    def close(self, now):
+        if self.finished:
+            return
+        self.timers.cancel(self.lingerTimer)
+        self.finished = True
+        log.info("Closed connection")
+        trace = Metrics.trace
+        if trace != None:
+            trace.record(now, "closed", self.startSeqNum)
+
+    def receive(self, packet, now):
+        packetHeader = packet.packetHeader
+        if self.finished:
+            return
+        seq_num = packetHeader.seq_num
+
+        # An ACK from the sender confirms it has the ACK of the END packet, so nothing more will be re-sent (a fast close)
+        if packetHeader.type == 3:
+            if self.complete and seq_num == self.receiverWindowPos:
+                self.close(now)
+            return
+        stats = self.stats
+
+        # A PARITY packet is handled as the packet it rebuilds, if any; otherwise it is not ACKed
+        if packetHeader.type == 5:
+            if self.parityDecoder == None or self.complete:
+                return
+            stats.parityReceived += 1
+            packet = self.rebuilt(self.parityDecoder.addParity(packet), now)
+            if packet == None:
+                return
+            packetHeader = packet.packetHeader
+            seq_num = packetHeader.seq_num
+        stats.packetsReceived += 1
+
+        # After the END packet: the END packet (or any packet before it) is being re-sent, so the final ACK was lost
+        # The sender only retransmits the oldest packet it has not seen ACKed, which is not always the END packet
+        if self.complete:
+            stats.duplicatePackets += 1
+            if packetHeader.type in (1, 2, 4) and seq_num < self.receiverWindowPos:
+                self.timers.cancel(self.lingerTimer)
+                self.lingerTimer = self.timers.schedule(now + ReceiverSession.lingerTime)
+                self.sendACK(self.receiverWindowPos)
+            return
+
+        log.debug("Received P%04d Type: %d", seq_num - self.startSeqNum, packetHeader.type)
+
+        # Check start condition
+        if packetHeader.type == 0 and seq_num == self.startSeqNum and self.receiverWindowPos == self.startSeqNum + 1:
+            self.sendACK(seq_num, options = self.handshakeOptions())
+
+        # Check end condition
+        if packetHeader.type == 1 and self.receiverWindowPos == seq_num:
+            self.receiverWindowPos += 1
+            self.closeConnection(now)
+            return
+
+        # See if packet is in window
+        buffer = self.buffer
+        inOrder = seq_num == self.receiverWindowPos and len(buffer) == 0 # Neither behind a gap nor filling one
+        if seq_num < self.receiverWindowPos or seq_num in buffer: # Already received; the ACK below tells the sender what is expected
+            stats.duplicatePackets += 1
+        elif seq_num < self.receiverWindowPos + self.windowSize:   # Add to buffer
+            buffer[seq_num] = packet
+            if seq_num > self.receiverWindowPos:
+                stats.outOfOrderPackets += 1
+            if self.parityDecoder != None: # The packet may complete the parity of its group
+                rebuiltPacket = self.rebuilt(self.parityDecoder.add(packet), now)
+                if rebuiltPacket != None:
+                    buffer[rebuiltPacket.packetHeader.seq_num] = rebuiltPacket
+        else:
+            stats.outsideWindow += 1
+
+        # Process the buffered packets in order, starting with the one the window is waiting for
+        while self.receiverWindowPos in buffer:
+            bufferedPacket = buffer.pop(self.receiverWindowPos)
+            self.receiverWindowPos += 1                          # Advance window pos 1
+            if bufferedPacket.packetHeader.type == 1:            # If end condition
+                self.closeConnection(now)                        #     End connection
+                return
+            elif bufferedPacket.packetHeader.type == 4:          # If the end of a message
+                self.endMessage()
+            else:
+                self.write(bufferedPacket.payload)               # Add the packet contents to the file contents
+        if self.parityDecoder != None:
+            self.parityDecoder.discardBelow(self.receiverWindowPos)
+        if len(buffer) > 0:
+            log.debug("Waiting on P%04d; %d packets buffered", self.receiverWindowPos - self.startSeqNum, len(buffer))
+        stats.bufferOccupancy.record(len(buffer))
+        trace = Metrics.trace
+        if trace != None:
+            trace.record(now, "receive", self.startSeqNum, seq_num - self.startSeqNum, packetHeader.type, len(buffer), self.receiverWindowPos - self.startSeqNum)
+
+        # Send ACK, or wait for more in-order DATA packets to ACK with it
+        if inOrder and packetHeader.type == 2 and len(buffer) == 0:
+            self.unacked += 1
+            if self.quickAcksLeft > 0:
+                self.quickAcksLeft -= 1
+            elif self.unacked < self.ackEvery:
+                if self.ackTimer == None:
+                    self.ackTimer = self.timers.schedule(now + self.ackDelay)
+                return
+        self.sendACK(self.receiverWindowPos, ReceiverSession.sackRanges(buffer, self.receiverWindowPos))
+
+    # Returns packet, a packet rebuilt by the parity decoder, if the receiver still needs it, otherwise None
+    def rebuilt(self, packet, now):
+        if packet == None:
+            return None
+        seq_num = packet.packetHeader.seq_num
+        if seq_num < self.receiverWindowPos or seq_num >= self.receiverWindowPos + self.windowSize or seq_num in self.buffer:
+            return None
+        self.stats.packetsRecovered += 1
+        log.debug("Rebuilt P%04d from parity", seq_num - self.startSeqNum)
+        trace = Metrics.trace
+        if trace != None:
+            trace.record(now, "rebuilt", self.startSeqNum, seq_num - self.startSeqNum, packet.packetHeader.type)
+        return packet
+
+    # Add the payload of the next packet in order to the file, decompressing it first if compression was agreed on
+    def write(self, payload):
+        if self.decompressor != None:
+            self.stats.compressedBytes += len(payload)
+            payload = self.decompressor.decompress(payload)
+            if len(payload) > len(self.writeBuffer): # Too large to buffer, so it goes straight to the sink
+                self.flush()
+                self.sink.write(payload)
+                self.stats.bytesReceived += len(payload)
+                return
+        if self.writeBufferPos + len(payload) > len(self.writeBuffer):
+            self.flush()
+        self.writeBuffer[self.writeBufferPos:self.writeBufferPos + len(payload)] = payload
+        self.writeBufferPos += len(payload)
+        self.stats.bytesReceived += len(payload)
+
+    # Write the buffered payloads to the sink
+    # The sink gets a copy, since writeBuffer is reused and a sink may keep what it is given
+    def flush(self):
+        if self.writeBufferPos > 0:
+            self.sink.write(bytes(memoryview(self.writeBuffer)[:self.writeBufferPos]))
+            self.writeBufferPos = 0
+
+    # A MESSAGE packet has been processed: the bytes received since the last one are a message
+    def endMessage(self):
+        self.stats.messagesReceived += 1
+        if self.splitMessages:
+            self.flush()
+            self.messages.append(self.sink.getvalue())
+            self.sink = io.BytesIO()
+
+    # The END packet has been processed: deliver the file, ACK the END packet and linger
+    # Wait lingerTime to make sure the END message (or any packet before it) is not being re-sent
+    def closeConnection(self, now):
+        self.flush()
+        self.writeBuffer = None
+        if self.splitMessages:
+            if self.sink.tell() > 0: # The sender closed without ending the last message
+                self.endMessage()
+            self.sink = None
+        elif self.collect:
+            self.receivedFile = self.sink.getvalue()
+            self.sink = None
+        self.buffer = {}
+        self.complete = True
+        log.info("Received %d bytes", self.stats.bytesReceived)
+        trace = Metrics.trace
+        if trace != None:
+            trace.record(now, "delivered", self.startSeqNum, self.stats.bytesReceived)
+        self.sendACK(self.receiverWindowPos)
+        self.lingerTimer = self.timers.schedule(now + ReceiverSession.lingerTime)
+
+class SessionTable:
+
+    # Demultiplexes the packets of many senders into independent ReceiverSessions, keyed by (sender address, start sequence number)
+    # Like a session it never touches the network: pass it every valid packet and send the (packet, address) pairs transmit returns
+    # openSink(address) returns the sink a new sender's file is written to (see ReceiverSession); without it files are collected in memory
+    # onFile(address, receivedFile) is called once for every file received with the file, or with its sink if there is openSink
+    # At most maxSessions sessions are kept; a session that has not received a packet for idleTimeout ns is dropped
+    # The sink of a session that is dropped before it receives its file is closed
+    # A session that received its file is remembered for idleTimeout ns after it is dropped (at most maxSessions of them),
+    # so a late retransmission of its START packet is ACKed again rather than opening a new session and sink
+    # maxPayloadSize, ackEvery and ackDelay are passed to every ReceiverSession
+    def __init__(self, windowSize, onFile, selectiveAck = True, maxSessions = 64, idleTimeout = 3e10, openSink = None, maxPayloadSize = None, ackEvery = None, ackDelay = None):
+        self.windowSize = windowSize
+        self.maxPayloadSize = maxPayloadSize
+        self.ackEvery = ackEvery
+        self.ackDelay = ackDelay
+        self.onFile = onFile
+        self.openSink = openSink
+        self.selectiveAck = selectiveAck
+        self.maxSessions = maxSessions
+        self.idleTimeout = idleTimeout
+
+        self.sessions = {}     # (address, startSeqNum) -> ReceiverSession
+        self.byAddress = {}    # address -> {startSeqNum: key} for the sessions of each sender
+        self.lastActivity = {} # key -> when (ns) the session last received a packet
+        self.delivered = set() # Keys of the sessions whose file has been passed to onFile
+        self.ready = {}        # Keys of the sessions to call transmit on, in order
+        self.deadlines = []    # Min-heap of (deadline, count, key); an entry is stale unless it matches self.scheduled
+        self.scheduled = {}    # key -> the deadline the session is woken up at
+        self.count = 0         # Breaks ties between entries with the same deadline
+        self.finished = {}     # Key of a dropped session that received its file -> (when it is forgotten, ACK of its START), oldest first
+        self.replies = []      # (packet, address) pairs to send with the next transmit that belong to no session
+
+        self.filesReceived = 0 # Files passed to onFile
+        self.sessionsEvicted = 0 # Sessions dropped because they were idle or the table was full
+
+    # Returns the key of the session a packet from address with seq_num belongs to, or None if there is none
+    # Sequence numbers follow the start sequence number, so it is the session with the highest start below seq_num
+    def find(self, address, seq_num):
+        starts = self.byAddress.get(address)
+        if starts == None:
+            return None
+        below = [startSeqNum for startSeqNum in starts if startSeqNum < seq_num]
+        return starts[max(below)] if len(below) > 0 else None
+
+    # Handle a valid packet from any sender
+    def receive(self, packet, now):
+        address = packet.packetHeader.address
+        seq_num = packet.packetHeader.seq_num
+        if packet.packetHeader.type == 0 and (address, seq_num) not in self.sessions:
+            self.forgetFinished(now)
+            if (address, seq_num) in self.finished: # A START that arrived after its session finished
+                self.replies.append((self.finished[(address, seq_num)][1], address))
+                return
+            # A new sender; the START packet is dropped if there is no room, so the sender will retransmit it
+            if len(self.sessions) >= self.maxSessions and not self.evictOne():
+                log.warning("Session table full; ignoring START from %s", address)
+                return
+            key = (address, seq_num)
+            sink = self.openSink(address) if self.openSink != None else None
+            self.sessions[key] = ReceiverSession(packet, self.windowSize, self.selectiveAck, sink, self.maxPayloadSize, ackEvery = self.ackEvery, ackDelay = self.ackDelay)
+            self.byAddress.setdefault(address, {})[seq_num] = key
+            log.info("Connected to (%s, %d); %d sessions", address[0], address[1], len(self.sessions))
+        else:
+            key = (address, seq_num) if packet.packetHeader.type == 0 else self.find(address, seq_num)
+            if key == None:
+                return
+            self.sessions[key].receive(packet, now)
+
+        session = self.sessions[key]
+        self.lastActivity[key] = now
+        self.ready[key] = None
+        if session.complete and key not in self.delivered:
+            self.delivered.add(key)
+            self.filesReceived += 1
+            self.onFile(address, session.receivedFile if session.collect else session.sink)
+
+    # Returns when (time.monotonic_ns) transmit should next be called, or None if only a packet can move a session forward
+    def nextDeadline(self):
+        if len(self.ready) > 0 or len(self.replies) > 0:
+            return 0
+        while len(self.deadlines) > 0 and self.scheduled.get(self.deadlines[0][2]) != self.deadlines[0][0]:
+            heapq.heappop(self.deadlines)
+        return self.deadlines[0][0] if len(self.deadlines) > 0 else None
+
+    # Returns the (packet, address) pairs every session wants sent now
+    # Runs the sessions that received packets or whose deadline has passed, and drops the ones that are finished or idle
+    def transmit(self, now) -> list:
+        while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+            (deadline, _, key) = heapq.heappop(self.deadlines)
+            if self.scheduled.get(key) == deadline:
+                del self.scheduled[key]
+                self.ready[key] = None
+
+        packets = self.replies
+        self.replies = []
+        for key in self.ready:
+            session = self.sessions.get(key)
+            if session == None:
+                continue
+            if now - self.lastActivity[key] >= self.idleTimeout:
+                log.info("Dropping idle session from %s", key[0])
+                trace = Metrics.trace
+                if trace != None:
+                    trace.record(now, "evicted", key[1], f"{key[0][0]}:{key[0][1]}")
+                self.remove(key)
+                self.sessionsEvicted += 1
+                continue
+            packets.extend((packet, session.targetAddress) for packet in session.transmit(now))
+            if session.finished:
+                self.remove(key)
+            else:
+                self.schedule(key)
+        self.ready = {}
+        return packets
+
+    # Wake the session up at its next deadline or when it becomes idle, whichever is first
+    # Only an earlier deadline adds a heap entry; a later one is picked up when the current entry expires
+    def schedule(self, key):
+        deadline = self.lastActivity[key] + self.idleTimeout
+        sessionDeadline = self.sessions[key].nextDeadline()
+        if sessionDeadline != None:
+            deadline = min(deadline, sessionDeadline)
+        if key not in self.scheduled or deadline < self.scheduled[key]:
+            self.scheduled[key] = deadline
+            heapq.heappush(self.deadlines, (deadline, self.count, key))
+            self.count += 1
+
+    # Drop the least recently active session that has already received its file to make room for a new one
+    # Returns False if every session is still receiving
+    def evictOne(self) -> bool:
+        lingering = [key for key in self.sessions if self.sessions[key].complete]
+        if len(lingering) == 0:
+            return False
+        self.remove(min(lingering, key = lambda key: self.lastActivity[key]))
+        self.sessionsEvicted += 1
+        return True
+
+    # Forget everything about a session, except its START if it received its file; see forgetFinished
+    def remove(self, key):
+        (address, startSeqNum) = key
+        session = self.sessions.pop(key)
+        if not session.complete and not session.collect:
+            session.sink.close()
+        if session.complete:
+            self.finished[key] = (self.lastActivity[key] + self.idleTimeout, Utility.Packet.newAckPacket(startSeqNum, self.windowSize, (), session.handshakeOptions()))
+            if len(self.finished) > self.maxSessions:
+                del self.finished[next(iter(self.finished))]
+        del self.byAddress[address][startSeqNum]
+        if len(self.byAddress[address]) == 0:
+            del self.byAddress[address]
+        self.lastActivity.pop(key, None)
+        self.scheduled.pop(key, None)
+        self.delivered.discard(key)
+
+    # Forget the finished sessions whose time is up at now (ns), so a sender that reuses the start sequence number is a new session
+    def forgetFinished(self, now):
+        while len(self.finished) > 0:
+            key = next(iter(self.finished))
+            if self.finished[key][0] > now:
+                break
+            del self.finished[key]
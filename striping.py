@@ -0,0 +1,125 @@
+import os, struct, multiprocessing
+from RDTSocket import RDTSocket
+
+# Striped transfers split a file into byte ranges and send each range over its own RDT connection, in its own process,
+# so that the packet encoding, checksums and send loops of the ranges run on separate cores
+# Each stream starts with the offset of its range (rangeHeader), so the receiver can write it in place as it arrives
+rangeHeader = struct.Struct("!Q")
+
+# Returns the (offset, length) of each of the streams ranges of a size byte file
+# The ranges are consecutive and their lengths differ by at most one byte
+def ranges(size, streams) -> list:
+    (length, extra) = divmod(size, streams)
+    result = []
+    offset = 0
+    for i in range(streams):
+        result.append((offset, length + (1 if i < extra else 0)))
+        offset += result[-1][1]
+    return result
+
+class RangeReader:
+
+    # Reads the length bytes of the binary file f from offset, after the offset itself (see rangeHeader)
+    # Can be sent like any file object; see Session.SenderSession
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.header = rangeHeader.pack(offset)
+        self.remaining = length
+        f.seek(offset)
+
+    def read(self, size) -> bytes:
+        header = self.header
+        self.header = b""
+        data = self.f.read(max(min(size - len(header), self.remaining), 0))
+        self.remaining -= len(data)
+        return header + data
+
+class RangeWriter:
+
+    # Writes a stream sent by a RangeReader into the binary file f (opened with "r+b") at the offset in its header
+    # Can be used as the sink of a receiver; see Session.ReceiverSession
+    def __init__(self, f):
+        self.f = f
+        self.header = bytearray()
+        self.offset = None
+
+    def write(self, data):
+        if self.offset == None:
+            missing = rangeHeader.size - len(self.header)
+            self.header += data[:missing]
+            data = data[missing:]
+            if len(self.header) < rangeHeader.size:
+                return
+            (self.offset,) = rangeHeader.unpack(self.header)
+            self.f.seek(self.offset)
+        self.f.write(data)
+
+# Send one range of the file at path to address; the target of each sender process
+def sendRange(results, index, path, offset, length, address, windowSize, options):
+    try:
+        sendSocket = RDTSocket(windowSize, **options)
+        with open(path, "rb") as f:
+            sendSocket.send(RangeReader(f, offset, length), address)
+        results.put(("done", index, sendSocket.statistics()))
+    except Exception as e:
+        results.put(("failed", index, repr(e)))
+
+# Receive one range of a file into the file at path on address; the target of each receiver process
+# The socket is bound before the process reports that it is ready, so no START packet is sent to a closed port
+def receiveRange(results, index, path, address, windowSize, options):
+    try:
+        recvSocket = RDTSocket(windowSize, address[0], address[1], **options)
+        results.put(("ready", index, recvSocket.socket.getsockname()))
+        with open(path, "r+b") as f:
+            recvSocket.recvFile(RangeWriter(f))
+        results.put(("done", index, recvSocket.statistics()))
+        recvSocket.waitClosed()
+    except Exception as e:
+        results.put(("failed", index, repr(e)))
+
+# Run target(results, index, *arguments) in a process for each tuple of arguments and return the result of each, in order
+# onReady is called with the address of each process once they have all reported that they are ready
+def runStreams(target, argumentsList, onReady = None) -> list:
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target = target, args = (results, index, *arguments)) for (index, arguments) in enumerate(argumentsList)]
+    for process in processes:
+        process.start()
+
+    addresses = [None] * len(processes)
+    stats = [None] * len(processes)
+    (ready, done) = (0, 0)
+    try:
+        while done < len(processes):
+            (status, index, value) = results.get()
+            match status:
+                case "ready":
+                    addresses[index] = value
+                    ready += 1
+                    if ready == len(processes) and onReady != None:
+                        onReady(addresses)
+                case "done":
+                    stats[index] = value
+                    done += 1
+                case "failed":
+                    raise Exception(f"Striping.runStreams: stream {index} failed: {value}")
+    except:
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        for process in processes:
+            process.join()
+    return stats
+
+# Send the file at path striped over one stream per address in addresses and return the statistics of each stream
+# options are passed to the RDTSocket of each stream
+def sendStriped(path, addresses, windowSize, options = {}) -> list:
+    size = os.path.getsize(path)
+    return runStreams(sendRange, [(path, offset, length, address, windowSize, options) for ((offset, length), address) in zip(ranges(size, len(addresses)), addresses)])
+
+# Receive a file sent by sendStriped into the file at path, with one stream on each (ip, port) in addresses
+# onReady is called with the bound addresses once every stream is listening, so port 0 can be used
+# Returns the statistics of each stream once the whole file has been written
+def recvStriped(path, addresses, windowSize, options = {}, onReady = None) -> list:
+    open(path, "wb").close()
+    return runStreams(receiveRange, [(path, address, windowSize, options) for address in addresses], onReady)
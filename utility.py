@@ -1,157 +1,246 @@
-import socket, random, zlib, pickle
+import socket, selectors, heapq, time, struct, zlib, sys, collections
+import impairment as Impairment
+import metrics as Metrics
 
 class UnreliableSocket:
     
-    probabilityOfFailure = .7
+    # Impairment of received datagrams used unless one is given; about the failures the original simulator produced
+    # (70% of the packets were lost, delayed or corrupted)
+    defaultImpairment = "loss=0.23,reorder=0.3,corrupt=0.3"
+    maxDatagramSize = 1400 # Default largest datagram (in bytes) that sendto will send
     
-    def __init__(self, ip = None, port = None):
+    # Linux socket options used to read the path MTU; the socket module does not define them
+    IP_MTU_DISCOVER = 10
+    IP_PMTUDISC_DO = 2
+    IP_MTU = 14
+    ipUdpHeaderSize = 28   # Bytes the IPv4 and UDP headers add to every datagram
+    maxUdpPayload = 65507  # Largest datagram UDP over IPv4 can carry
+    
+    # inbound and outbound are the impairments (Impairment.Impairment or a spec for Impairment.Impairment.parse) applied to
+    # the datagrams the socket receives and sends. inbound defaults to UnreliableSocket.defaultImpairment; "" turns it off
+    def __init__(self, ip = None, port = None, inbound = None, outbound = None):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.messageQueue = []     # Used to store an internal list of packets for delaying and reordering them
-        self.delayedMessage = None # Used to store a delayed message
+        self.selector = selectors.DefaultSelector() # Used to sleep until a datagram arrives
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        self.maxDatagramSize = UnreliableSocket.maxDatagramSize
+        self.connectOnSend = True  # Connect the socket to the address of the first datagram sent
+        
+        self.inbound = UnreliableSocket.impairment(UnreliableSocket.defaultImpairment if inbound == None else inbound)
+        self.outbound = UnreliableSocket.impairment(outbound)
+        self.arrived = collections.deque() # Datagrams that have come out of the inbound impairment
+        self.stats = Metrics.SocketStats()
         
         self.address = (ip, port)
         # Bind the socket if it has an address to bind to
         if ip != None:
             self.bind()
     
+    # Returns impairment as an Impairment.Impairment, parsing it if it is a spec; None or "" is no impairment
+    @staticmethod
+    def impairment(impairment):
+        if impairment == None or isinstance(impairment, Impairment.Impairment):
+            return impairment
+        return Impairment.Impairment.parse(impairment)
+    
     # Used to bind the socket to a port
     def bind(self):
         self.socket.bind(self.address)
     
+    # Sleep until the socket has a datagram to read or deadline (time.monotonic_ns) passes
+    # A deadline of None waits forever
+    def wait(self, deadline):
+        timeout = None if deadline == None else max(deadline - time.monotonic_ns(), 0) / 1e9
+        self.selector.select(timeout)
+    
     # Returns the results in the format (Packet, address)
     # If there is nothing to return, it returns (None, None)
-    def recvfrom(self, bufferSize):
-        # Receive new data
-        try:
-            newMessage = self.socket.recvfrom(bufferSize, socket.MSG_DONTWAIT)
-        except:
-            newMessage = (None, None)
-        (packetData, _) = newMessage
-        if packetData != None:
-            self.messageQueue.append(newMessage)
-        
-        # Handle delayed message (if there is one)
-        if self.delayedMessage != None:
-            self.messageQueue.append(self.delayedMessage)
-            self.delayedMessage = None
-        
-        # If there is nothing in the queue, return nothing
-        if len(self.messageQueue) == 0:
-            return (None, None)
-        
-        # Select a message
-        currentMessage = self.messageQueue.pop(0)
-        packet = pickle.loads(currentMessage[0])
-    
-        # Apply simulated failures
-        if random.random() < UnreliableSocket.probabilityOfFailure:
-            simulatedEvent = random.choice(["packet loss", "packet delay", "packet corruption"])  
-                
-            # Apply the selected event  
-            match simulatedEvent:
-                case "packet loss":
+    # Blocks until a datagram arrives or deadline (time.monotonic_ns) passes; None blocks until a datagram arrives
+    # The default deadline of 0 returns immediately
+    # Datagrams that are corrupted or malformed are dropped like lost packets
+    def recvfrom(self, bufferSize, deadline = 0):
+        while True:
+            now = time.monotonic_ns()
+            self.release(now)
+            
+            # Read every datagram waiting in the socket and pass it through the inbound impairment
+            while True:
+                try:
+                    (data, address) = self.socket.recvfrom(bufferSize, socket.MSG_DONTWAIT)
+                except OSError:
+                    break
+                if self.inbound == None:
+                    self.arrived.append((data, address))
+                else:
+                    self.inbound.put(data, address, now)
+            if self.inbound != None:
+                self.arrived.extend(self.inbound.take(now))
+            
+            # Return the next datagram to come out
+            if len(self.arrived) > 0:
+                (data, address) = self.arrived.popleft()
+                stats = self.stats
+                stats.datagramsReceived += 1
+                stats.bytesReceived += len(data)
+                packet = PacketCodec.decode(data, address)
+                if packet == None:
+                    stats.invalidDatagrams += 1
+                    trace = Metrics.trace
+                    if trace != None:
+                        trace.record(now, "invalid", None, len(data))
                     return (None, None)
-                case "packet delay":
-                    self.delayedMessage = currentMessage
-                    return (None, None)
-                case "packet corruption":
-                    if packet.text != None: # If there is data to corrupt, corrupt it
-                        encodedText = bytearray(packet.text, "utf-8")
-                        selectedByte = random.randint(0, len(encodedText)-1)      # Select a byte to modify
-                        encodedText[selectedByte] = encodedText[selectedByte] ^ 5 # Modify the byte
-                        packet.text = encodedText.decode("utf-8")                 # Switch the data to the modified data
-
-        # Return the message
-        returnTuple = (packet, currentMessage[1])
-        return returnTuple
+                return (packet, address)
+            
+            if deadline != None and now >= deadline:
+                return (None, None)
+            
+            # Sleep until a datagram arrives, one comes out of an impairment or the deadline passes
+            wakeUp = deadline
+            for impairment in (self.inbound, self.outbound):
+                impairmentDeadline = impairment.nextDeadline() if impairment != None else None
+                if impairmentDeadline != None and (wakeUp == None or impairmentDeadline < wakeUp):
+                    wakeUp = impairmentDeadline
+            self.wait(wakeUp)
     
     # Used to send a packet       
     def sendto(self, packet, address):
         # Encode package
-        packet.packetHeader.address = self.socket.getsockname()
-        data = pickle.dumps(packet)
+        data = PacketCodec.encode(packet)
         # Check for packages that are too long
-        if len(data) > 1400:
-            raise Exception(f"data size too big: {len(data)} > 1400")
+        if len(data) > self.maxDatagramSize:
+            raise Exception(f"data size too big: {len(data)} > {self.maxDatagramSize}")
+        self.stats.datagramsSent += 1
+        self.stats.bytesSent += len(data)
         
-        # Send
+        # Send it now, or once it comes out of the outbound impairment
+        if self.outbound == None:
+            self.transmit(data, address)
+        else:
+            now = time.monotonic_ns()
+            self.outbound.put(data, address, now)
+            self.release(now)
+    
+    # Send the datagrams that have come out of the outbound impairment by time now (ns)
+    def release(self, now):
+        if self.outbound != None:
+            for (data, address) in self.outbound.take(now):
+                self.transmit(data, address)
+    
+    # Wait until every datagram held by the outbound impairment has been sent
+    # Called once a connection is over, since nothing else would release the last packets it sent
+    def drain(self):
+        while self.outbound != None and self.outbound.nextDeadline() != None:
+            time.sleep(max(self.outbound.nextDeadline() - time.monotonic_ns(), 0) / 1e9)
+            self.release(time.monotonic_ns())
+    
+    # Write a datagram to the socket
+    def transmit(self, data, address):
+        if not self.connectOnSend:
+            self.socket.sendto(data, address)
+            return
         try:
             self.socket.send(data)
         except: # If there is an error, connect the socket first
             self.socket.connect(address)
             self.socket.send(data)
     
+    # Returns the largest datagram (in bytes) that can reach the address sock is connected to without being fragmented
+    # Returns None if the path MTU cannot be read, which is the case on every platform except Linux
+    @staticmethod
+    def pathMTU(sock):
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            # Turn on path MTU discovery (don't-fragment) while the MTU is read so the kernel reports the path's MTU
+            previous = sock.getsockopt(socket.IPPROTO_IP, UnreliableSocket.IP_MTU_DISCOVER)
+            sock.setsockopt(socket.IPPROTO_IP, UnreliableSocket.IP_MTU_DISCOVER, UnreliableSocket.IP_PMTUDISC_DO)
+            mtu = sock.getsockopt(socket.IPPROTO_IP, UnreliableSocket.IP_MTU)
+            sock.setsockopt(socket.IPPROTO_IP, UnreliableSocket.IP_MTU_DISCOVER, previous)
+        except OSError:
+            return None
+        return min(mtu - UnreliableSocket.ipUdpHeaderSize, UnreliableSocket.maxUdpPayload)
+    
     # Close the socket
     def close(self):
+        self.selector.close()
         self.socket.close()
         
 class PacketHeader:
     
-    def __init__(self, type, seq_num, length, checksum):
-        self.type = type         # 0: START; 1: END; 2: DATA; 3: ACK
+    __slots__ = ("type", "seq_num", "length", "checksum", "window", "address")
+    
+    def __init__(self, type, seq_num, length, checksum, window = 0):
+        self.type = type         # 0: START; 1: END; 2: DATA; 3: ACK; 4: MESSAGE (ends a message); 5: PARITY (see fec.py)
         self.seq_num = seq_num 
-        self.length = length     # Length of data; 0 for ACK, START, and END packets
-        self.checksum = checksum # 32-bit CRC
-        self.address = None      # Sender socket address
+        self.length = length     # Length of data in bytes; size of the SACK blocks for ACK packets; 0 for START, END and MESSAGE packets
+        self.checksum = checksum # 32-bit CRC of the whole datagram; filled in by PacketCodec.encode and checked by PacketCodec.decode
+        self.window = window     # Receiver window (in packets) advertised by ACK packets; 0 for other packets
+        self.address = None      # Sender socket address (filled in when the packet is received)
         
     def __eq__(self, obj):
         if type(self) != type(obj):
             return False
         else:
-            return self.type == obj.type and self.seq_num == obj.seq_num and self.length == obj.length and self.checksum == obj.checksum
+            return self.type == obj.type and self.seq_num == obj.seq_num and self.length == obj.length and self.window == obj.window
 
 class Packet:
     
-    def __init__(self, packetHeader, text):
+    __slots__ = ("packetHeader", "payload", "sack", "options")
+    
+    def __init__(self, packetHeader, payload, sack = (), options = None):
         self.packetHeader = packetHeader
-        self.text = text
+        self.payload = payload # Bytes carried by DATA and PARITY packets; None for other packets
+        self.sack = sack # SACK blocks of ACK packets: (start, end) pairs of received sequence numbers, end exclusive
+        self.options = options if options != None else {} # Handshake options of START packets and their ACKs; see PacketCodec.handshakeOptions
     
     @classmethod
-    def newStartPacket(cls, seq_num):
-        newPacket = Packet(None, None)
-        newPacket.packetHeader = PacketHeader(0, seq_num, 0, newPacket.compute_checksum())
+    def newStartPacket(cls, seq_num, options = None):
+        newPacket = Packet(None, None, (), options)
+        newPacket.packetHeader = PacketHeader(0, seq_num, 0, 0)
         return newPacket
     
     @classmethod
     def newEndPacket(cls, seq_num):
         newPacket = Packet(None, None)
-        newPacket.packetHeader = PacketHeader(1, seq_num, 0, newPacket.compute_checksum())
+        newPacket.packetHeader = PacketHeader(1, seq_num, 0, 0)
         return newPacket
 
     @classmethod
-    def newDataPacket(cls, seq_num, text):
-        newPacket = Packet(None, text)
-        newPacket.packetHeader = PacketHeader(2, seq_num, len(text), newPacket.compute_checksum())
+    def newMessagePacket(cls, seq_num):
+        newPacket = Packet(None, None)
+        newPacket.packetHeader = PacketHeader(4, seq_num, 0, 0)
+        return newPacket
+
+    @classmethod
+    def newParityPacket(cls, seq_num, payload):
+        newPacket = Packet(None, payload)
+        newPacket.packetHeader = PacketHeader(5, seq_num, len(payload), 0)
+        return newPacket
+
+    @classmethod
+    def newDataPacket(cls, seq_num, payload):
+        newPacket = Packet(None, payload)
+        newPacket.packetHeader = PacketHeader(2, seq_num, len(payload), 0)
         return newPacket
     
     @classmethod
-    def newAckPacket(cls, seq_num):
-        newPacket = Packet(None, None)
-        newPacket.packetHeader = PacketHeader(3, seq_num, 0, newPacket.compute_checksum())
+    def newAckPacket(cls, seq_num, window = 0, sack = (), options = None):
+        newPacket = Packet(None, None, sack, options)
+        newPacket.packetHeader = PacketHeader(3, seq_num, len(sack) * PacketCodec.sackBlock.size, 0, window)
         return newPacket
     
     @staticmethod
     def getSeqNum(packet) -> int:
         return packet.packetHeader.seq_num
     
-    def compute_checksum(self) -> int:
-        if self.text != None:
-            return zlib.crc32(self.text.encode())
-        else:
-            return 0
-    
-    def verify_packet(self) -> bool:
-        return self.packetHeader.checksum == self.compute_checksum()
-
-    # Get the estimated size of the package when it will be sent
+    # Get the size of the package when it will be sent
     def compressedSize(self) -> int:
-        return len(pickle.dumps(self))
+        return len(PacketCodec.encode(self))
     
     def __eq__(self, obj):
         if type(obj) != type(self):
             return False
         else:
-            return self.packetHeader == obj.packetHeader and self.text == obj.text
+            return self.packetHeader == obj.packetHeader and self.payload == obj.payload and tuple(self.sack) == tuple(obj.sack) and self.options == obj.options
         
     # Used to see if the package is in the input list
     def isInList(self, list):
@@ -161,6 +250,167 @@ class Packet:
                 found = True
         return found
 
+class PacketCodec:
+    
+    # Wire format (network byte order), followed by the payload:
+    #   version (1 byte) | type (1 byte) | seq_num (4 bytes) | length (2 bytes) | window (2 bytes) | checksum (4 bytes)
+    # The payload of DATA packets is the file data
+    # The payload of ACK packets is a list of SACK blocks: start (4 bytes) | end (4 bytes)
+    # If optionsFlag is set in the type, the payload starts with handshake options:
+    #   length of the options (2 bytes), then for each option: kind (1 byte) | length (1 byte) | value
+    # Version 2 added the advertised receiver window; version 3 added SACK blocks; version 4 made DATA payloads bytes instead of UTF-8 text
+    # The checksum is the CRC-32 of the datagram without the checksum field, so corruption anywhere in it is detected
+    # Version 5 added handshake options; version 6 extended the checksum from the payload to the whole datagram
+    # Version 7 added MESSAGE packets, which take a sequence number after the last DATA packet of each message
+    # PARITY packets are only sent once both sides agree on the fecGroup option, so they did not need a new version
+    version = 7
+    header = struct.Struct("!BBIHHI")
+    headerBeforeChecksum = struct.Struct("!BBIHH")
+    checksum = struct.Struct("!I")
+    sackBlock = struct.Struct("!II")
+    optionsLength = struct.Struct("!H")
+    optionHeader = struct.Struct("!BB")
+    optionsFlag = 0x80
+    maxType = 5 # PARITY; datagrams with a higher type are dropped
+    
+    # Options the sender proposes in START and the receiver answers in the ACK of START, by kind: (name, format of the value)
+    # Options with a kind the receiver does not know are skipped
+    handshakeOptions = {
+        1: ("maxPayload", struct.Struct("!H")), # Largest DATA payload (in bytes) the side can send or receive
+        2: ("fecGroup", struct.Struct("!B")),   # Packets per PARITY packet the sender proposes and the receiver accepts; see fec.py
+        3: ("compression", struct.Struct("!B")), # Id of the codec the sender compresses DATA with, if the receiver has it; see compression.py
+    }
+    optionKinds = {name: (kind, format) for (kind, (name, format)) in handshakeOptions.items()}
+    
+    # Encode a packet into the bytes that are sent over the wire
+    @staticmethod
+    def encode(packet) -> bytes:
+        packetHeader = packet.packetHeader
+        type = packetHeader.type
+        if type == 3:
+            payload = b"".join([PacketCodec.sackBlock.pack(start, end) for (start, end) in packet.sack])
+        else:
+            payload = packet.payload if packet.payload != None else b""
+        if len(packet.options) > 0:
+            options = b""
+            for (name, value) in packet.options.items():
+                (kind, format) = PacketCodec.optionKinds[name]
+                options += PacketCodec.optionHeader.pack(kind, format.size) + format.pack(value)
+            payload = PacketCodec.optionsLength.pack(len(options)) + options + payload
+            type |= PacketCodec.optionsFlag
+        headerBeforeChecksum = PacketCodec.headerBeforeChecksum.pack(PacketCodec.version, type, packetHeader.seq_num, len(payload), packetHeader.window)
+        checksum = zlib.crc32(payload, zlib.crc32(headerBeforeChecksum))
+        return headerBeforeChecksum + PacketCodec.checksum.pack(checksum) + payload
+    
+    # Decode the bytes received from the wire into a packet
+    # The header is read in place from a memoryview so the datagram is never copied
+    # Returns None if the data is not a valid packet for this version of the codec or its checksum does not match
+    @staticmethod
+    def decode(data, address = None):
+        view = memoryview(data)
+        if len(view) < PacketCodec.header.size:
+            return None
+        (version, type, seq_num, length, window, checksum) = PacketCodec.header.unpack_from(view)
+        if version != PacketCodec.version or len(view) != PacketCodec.header.size + length:
+            return None
+        if zlib.crc32(view[PacketCodec.header.size:], zlib.crc32(view[:PacketCodec.headerBeforeChecksum.size])) != checksum:
+            return None
+        
+        # Read the handshake options
+        options = {}
+        offset = PacketCodec.header.size
+        if type & PacketCodec.optionsFlag:
+            type &= ~PacketCodec.optionsFlag
+            if len(view) < offset + PacketCodec.optionsLength.size:
+                return None
+            (optionsLength,) = PacketCodec.optionsLength.unpack_from(view, offset)
+            offset += PacketCodec.optionsLength.size
+            end = offset + optionsLength
+            if end > len(view):
+                return None
+            while offset < end:
+                if end - offset < PacketCodec.optionHeader.size:
+                    return None
+                (kind, size) = PacketCodec.optionHeader.unpack_from(view, offset)
+                offset += PacketCodec.optionHeader.size
+                if offset + size > end:
+                    return None
+                if kind in PacketCodec.handshakeOptions:
+                    (name, format) = PacketCodec.handshakeOptions[kind]
+                    if size != format.size:
+                        return None
+                    (options[name],) = format.unpack_from(view, offset)
+                offset += size
+        
+        if type > PacketCodec.maxType:
+            return None
+        
+        # Only DATA and PARITY packets carry a payload and only ACK packets carry SACK blocks
+        payload = None
+        sack = ()
+        if type == 2 or type == 5:
+            payload = bytes(view[offset:])
+        elif type == 3:
+            if (len(view) - offset) % PacketCodec.sackBlock.size != 0:
+                return None
+            sack = list(PacketCodec.sackBlock.iter_unpack(view[offset:]))
+        
+        packetHeader = PacketHeader(type, seq_num, len(view) - offset, checksum, window) # The length does not count the options
+        packetHeader.address = address
+        return Packet(packetHeader, payload, sack, options)
+
+class Timer:
+    
+    __slots__ = ("deadline", "cancelled", "fired")
+    
+    def __init__(self, deadline):
+        self.deadline = deadline # When (time.monotonic_ns) the timer fires
+        self.cancelled = False   # True if the timer was cancelled before it fired
+        self.fired = False       # True once the deadline has passed
+
+class TimerQueue:
+    
+    # Keeps the protocol's timers in a min-heap ordered by deadline so the socket can sleep until the next one
+    # Cancelled timers stay in the heap until they reach the top, or until they make up most of the heap
+    def __init__(self):
+        self.heap = []
+        self.count = 0     # Breaks ties between timers with the same deadline
+        self.cancelled = 0 # Cancelled timers still in the heap
+    
+    # Returns a new timer that fires at deadline (time.monotonic_ns)
+    def schedule(self, deadline) -> Timer:
+        timer = Timer(deadline)
+        heapq.heappush(self.heap, (deadline, self.count, timer))
+        self.count += 1
+        return timer
+    
+    # Stop a timer from firing; timer may be None
+    def cancel(self, timer):
+        if timer != None and not timer.cancelled and not timer.fired:
+            timer.cancelled = True
+            self.cancelled += 1
+            # Rebuild the heap without the cancelled timers so restarting a timer over and over does not grow it
+            if self.cancelled > 16 and self.cancelled * 2 > len(self.heap):
+                self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+    
+    # Returns the deadline of the next timer to fire, or None if there are no timers
+    def nextDeadline(self):
+        while len(self.heap) > 0 and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+        return self.heap[0][0] if len(self.heap) > 0 else None
+    
+    # Mark every timer whose deadline is at or before now as fired
+    def runExpired(self, now):
+        while len(self.heap) > 0 and self.heap[0][0] <= now:
+            (_, _, timer) = heapq.heappop(self.heap)
+            if timer.cancelled:
+                self.cancelled -= 1
+            else:
+                timer.fired = True
+
 class Debug:
     
     # Fills in text will an input fill character to a certain length
@@ -0,0 +1,190 @@
+import heapq
+
+class PacketState:
+
+    __slots__ = ("packet", "sendTime", "transmissions", "queued", "sacked")
+
+    def __init__(self, packet):
+        self.packet = packet   # The packet being tracked
+        self.sendTime = None   # When (in ns) the packet was last sent; None if it has not been sent
+        self.transmissions = 0 # How many times the packet has been sent
+        self.queued = True     # True while the packet is waiting in the pending heap
+        self.sacked = False    # True once a selective ACK reported the packet as received
+
+class SendWindow:
+
+    exhaustedMarker = object() # Returned by next once packets has nothing more to yield
+
+    # packets must be an iterable that yields packets with consecutive sequence numbers starting at firstSeqNum
+    # Packets are only pulled from it as the window advances
+    # It may yield None when it has nothing to send yet; the window tries again the next time it is filled
+    def __init__(self, packets, firstSeqNum, windowSize):
+        self.packets = iter(packets)
+        self.exhausted = False        # True once every packet has been pulled from self.packets
+        self.windowSize = windowSize
+
+        self.base = firstSeqNum       # Lowest sequence number that has not been ACKed
+        self.nextSeqNum = firstSeqNum # Sequence number of the next packet to pull into the window
+        self.inWindow = {}            # seq_num -> PacketState for every packet in the window that has not been ACKed
+        self.pending = []             # Min-heap of the sequence numbers waiting to be sent or retransmitted
+        self.duplicateAcks = 0        # Number of ACKs in a row that did not advance the window
+        self.highestSacked = None     # Highest sequence number reported by a selective ACK
+
+    # Pull new packets into the window until it is full
+    def fill(self):
+        while not self.exhausted and self.nextSeqNum < self.base + self.windowSize:
+            packet = next(self.packets, SendWindow.exhaustedMarker)
+            if packet is SendWindow.exhaustedMarker:
+                self.exhausted = True
+            elif packet == None:
+                break
+            else:
+                self.inWindow[self.nextSeqNum] = PacketState(packet)
+                heapq.heappush(self.pending, self.nextSeqNum)
+                self.nextSeqNum += 1
+
+    # Returns True once every packet has been sent and ACKed
+    def isDone(self) -> bool:
+        self.fill()
+        return self.exhausted and len(self.inWindow) == 0
+
+    # Returns True if a packet is waiting to be sent
+    def hasPending(self) -> bool:
+        self.fill()
+        # Packets that were ACKed or selectively ACKed while waiting are skipped
+        while len(self.pending) > 0:
+            state = self.inWindow.get(self.pending[0])
+            if state != None and not state.sacked:
+                return True
+            heapq.heappop(self.pending)
+            if state != None:
+                state.queued = False
+        return False
+
+    # Returns the pending packet with the smallest sequence number, or None if nothing is waiting to be sent
+    def nextToSend(self):
+        if not self.hasPending():
+            return None
+        state = self.inWindow[heapq.heappop(self.pending)]
+        state.queued = False
+        return state.packet
+
+    # Record that the packet with seq_num was sent at time now (ns)
+    # Returns how many times the packet has been sent
+    def markSent(self, seq_num, now) -> int:
+        state = self.inWindow[seq_num]
+        state.sendTime = now
+        state.transmissions += 1
+        return state.transmissions
+
+    # Cumulative ACK: every packet with a sequence number lower than seq_num has been received
+    # Returns the number of packets that were newly ACKed
+    def ack(self, seq_num) -> int:
+        newlyAcked = 0
+        while self.base < seq_num and self.base < self.nextSeqNum:
+            del self.inWindow[self.base]
+            self.base += 1
+            newlyAcked += 1
+
+        # Count ACKs that repeat the lowest unACKed sequence number while packets are in flight
+        if newlyAcked > 0:
+            self.duplicateAcks = 0
+        elif seq_num == self.base and self.base in self.inWindow and not self.inWindow[self.base].queued:
+            self.duplicateAcks += 1
+        return newlyAcked
+
+    # Selective ACK: ranges is a list of (start, end) pairs and every packet with start <= seq_num < end has been received
+    # The packets stay in the window until they are ACKed cumulatively, but they are not retransmitted
+    # Returns the sequence numbers that were newly SACKed
+    def sack(self, ranges) -> list:
+        newlySacked = []
+        for (start, end) in ranges:
+            for seq_num in range(max(start, self.base), min(end, self.nextSeqNum)):
+                state = self.inWindow[seq_num]
+                if not state.sacked:
+                    state.sacked = True
+                    newlySacked.append(seq_num)
+            if end - 1 >= self.base and (self.highestSacked == None or end - 1 > self.highestSacked):
+                self.highestSacked = end - 1
+        return newlySacked
+
+    # Returns the sequence numbers of the packets that were sent but are missing below the highest SACKed packet
+    def holes(self) -> list:
+        if self.highestSacked == None or self.highestSacked < self.base:
+            return []
+        return [seq_num for seq_num in range(self.base, self.highestSacked) if not self.inWindow[seq_num].sacked and not self.inWindow[seq_num].queued]
+
+    # Returns the round trip time (ns) measured by an ACK of seq_num received at time now, or None if it gives no sample
+    # The cumulative ACK is ambiguous if any packet it newly ACKs was retransmitted (Karn's algorithm), since it may have
+    # been sent in response to the retransmission of a hole long after the last packet was sent
+    # In that case the newest packet the ACK newly SACKed (newlySacked, from sack) is used if it was only sent once
+    # Must be called before ack(seq_num) removes the packets from the window
+    def rttSample(self, seq_num, now, newlySacked = ()):
+        if seq_num > self.base and seq_num <= self.nextSeqNum:
+            if all(self.inWindow[ackedSeqNum].transmissions == 1 for ackedSeqNum in range(self.base, seq_num)):
+                return now - self.inWindow[seq_num - 1].sendTime
+        if len(newlySacked) > 0 and self.inWindow[newlySacked[-1]].transmissions == 1:
+            return now - self.inWindow[newlySacked[-1]].sendTime
+        return None
+
+    # Schedule the packet with seq_num to be sent again
+    def requeue(self, seq_num):
+        state = self.inWindow.get(seq_num)
+        if state != None and not state.queued and not state.sacked:
+            state.queued = True
+            heapq.heappush(self.pending, seq_num)
+
+    # Schedule every packet that has been sent but not ACKed to be sent again
+    # Returns the sequence numbers that were requeued
+    def requeueInFlight(self) -> list:
+        inFlight = self.inFlight()
+        for seq_num in inFlight:
+            self.requeue(seq_num)
+        return inFlight
+
+    # Returns True if the oldest packet that has not been ACKed has been sent and is not waiting to be sent again
+    # Packets pulled into the window that are still waiting on the congestion controller are not in flight
+    def baseInFlight(self) -> bool:
+        state = self.inWindow.get(self.base)
+        return state != None and state.sendTime != None and not state.queued
+
+    # Returns the sequence numbers of the packets that have been sent but not ACKed
+    def inFlight(self) -> list:
+        return [seq_num for (seq_num, state) in self.inWindow.items() if not state.queued and not state.sacked]
+
+class RTTEstimator:
+
+    # Retransmission timeout calculation from RFC 6298 (all times in ns)
+    alpha = 1 / 8 # Gain of the smoothed RTT
+    beta = 1 / 4  # Gain of the RTT variation
+    k = 4         # Weight of the RTT variation in the timeout
+    minRTO = 1e7  # 10 ms
+    maxRTO = 2e9  # 2 s; lower than the 60 s in the RFC so a burst of losses does not stall a transfer for minutes
+
+    def __init__(self, initialRTO):
+        self.initialRTO = initialRTO # Timeout used until the first sample
+        self.srtt = None             # Smoothed round trip time; None until the first sample
+        self.rttvar = None           # Round trip time variation
+        self.rto = initialRTO        # Current retransmission timeout, including any backoff
+
+    # Update the timeout with a new round trip time sample
+    def sample(self, rtt):
+        if self.srtt == None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTTEstimator.beta) * self.rttvar + RTTEstimator.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - RTTEstimator.alpha) * self.srtt + RTTEstimator.alpha * rtt
+        self.restore()
+
+    # Recompute the timeout from the measured RTT, discarding any backoff
+    # Used when new data is ACKed, because the path is delivering packets again
+    def restore(self):
+        if self.srtt == None:
+            self.rto = self.initialRTO
+        else:
+            self.rto = min(max(self.srtt + RTTEstimator.k * self.rttvar, RTTEstimator.minRTO), RTTEstimator.maxRTO)
+
+    # Double the timeout after a retransmission timer expires
+    def backoff(self):
+        self.rto = min(self.rto * 2, RTTEstimator.maxRTO)